@@ -0,0 +1,120 @@
+"""
+Columnar forecast payload for ``/api/cams/{cam_id}/forecast``.
+
+Every forecast day holds parallel arrays instead of a list of objects, so
+keys aren't repeated per point, and enum strings (tide types, wind direction
+types, ...) are sent once in ``enums`` and referenced by index. Minutes are
+relative to the day's midnight, like the tide charts of the web fragment.
+"""
+
+from datetime import date
+
+from surfline.parsers import DAY_MINUTES, DayBreak
+from surfline.urls import FORECAST_DAYS, day_window, forecast_dates
+
+SUNLIGHT_EVENTS = ("dawn", "sunrise", "sunset", "dusk")
+
+
+class EnumEncoder:
+    """Dictionary encoding of the string values of a payload."""
+
+    def __init__(self):
+        self.values: dict[str, dict[str, int]] = {}
+
+    def encode(self, enum: str, value: str) -> int:
+        codes = self.values.setdefault(enum, {})
+        return codes.setdefault(value, len(codes))
+
+    def dictionaries(self) -> dict[str, list[str]]:
+        return {enum: list(codes) for enum, codes in self.values.items()}
+
+
+def tide_columns(tides, day: int, enums: EnumEncoder) -> dict | None:
+    if not tides:
+        return None
+    points = tides["chart_points"]
+    # Includes the CHART_MARGIN_MINUTES around the day, as the charts do
+    window = day_window(points, [p["minutes"] for p in points], day * DAY_MINUTES)
+    return {
+        "minutes": [point["minutes"] for point in window],
+        "height": [round(point["height"], 2) for point in window],
+        "type": [enums.encode("tideType", point["type"]) for point in window],
+    }
+
+
+def sunlight_minutes(sunlight, day: int) -> dict | None:
+    if not sunlight or day >= len(sunlight["chart_data"]):
+        return None
+    offset = day * DAY_MINUTES
+    events = sunlight["chart_data"][day]
+    return {event: events[event] - offset for event in SUNLIGHT_EVENTS}
+
+
+def condition_columns(rows, enums: EnumEncoder) -> dict:
+    columns = {
+        name: []
+        for name in (
+            "minutes",
+            "windSpeed",
+            "windGust",
+            "windDirection",
+            "windDirectionType",
+            "windScore",
+            "surfMin",
+            "surfMax",
+            "surfHuman",
+            "surfScore",
+            "swellHeight",
+            "swellPeriod",
+            "swellDirection",
+            "power",
+        )
+    }
+    for wind, wave in rows:
+        values = (
+            wind.date.hour * 60 + wind.date.minute,
+            round(wind.speed, 1),
+            round(wind.gust, 1),
+            round(wind.direction),
+            enums.encode("windDirectionType", wind.direction_type),
+            wind.score,
+            round(wave.min, 1),
+            round(wave.max, 1),
+            enums.encode("surfHuman", wave.human),
+            wave.score,
+            round(wave.primary_swell_size, 1),
+            wave.primary_swell_period,
+            round(wave.primary_swell_direction),
+            round(wave.power),
+        )
+        for column, value in zip(columns.values(), values):
+            column.append(value)
+    return columns
+
+
+def forecast_payload(today: date, tides, sunlight, wind, waves) -> dict:
+    # Wind and wave rows of each day, split at the day breaks
+    days_rows = []
+    for w, wv in zip(wind, waves):
+        if isinstance(w, DayBreak):
+            days_rows.append([])
+        elif days_rows:
+            days_rows[-1].append((w, wv))
+    dates = forecast_dates(wind, today)
+    enums = EnumEncoder()
+    days = [
+        {
+            "date": dates[day].isoformat(),
+            "tides": tide_columns(tides, day, enums),
+            "sunlight": sunlight_minutes(sunlight, day),
+            "conditions": condition_columns(
+                days_rows[day] if day < len(days_rows) else (), enums
+            ),
+        }
+        for day in range(FORECAST_DAYS)
+    ]
+    return {
+        "tideUnit": tides["unit"] if tides else None,
+        "enums": enums.dictionaries(),
+        "days": days,
+    }
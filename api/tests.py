@@ -1,6 +1,32 @@
-from django.test import TestCase, override_settings
+import gzip
+import json
+import tempfile
+import threading
+from datetime import UTC, datetime
+from unittest import mock
 
-from cams.models import Category
+from asgiref.sync import async_to_sync
+from django.db import connection, transaction
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.utils import timezone
+from ninja.renderers import JSONRenderer
+
+from api.forecast import forecast_payload
+from api.serialization import ORJSONRenderer
+from api.urls import forecast_json_cache
+from cams import catalog, changelog
+from cams.index import get_index
+from cams.management.commands.benchmark_surfline_parsers import sample_payloads
+from cams.models import Cam, CatalogChange, Category, CategoryCam
+from cams.snapshots import SharedCatalog
+from surfcamsapi.scheduler import save_status
+from surfline.parsers import loads, parse_sunlight, parse_tides, parse_waves, parse_wind
+from surfline.urls import forecast_cache
 
 
 class TestHealthApi(TestCase):
@@ -21,3 +47,267 @@ class TestHealthApi(TestCase):
         response = self.client.get("/api/health")
         self.assertEqual(response.status_code, 503)
         self.assertEqual(response.json(), {"message": "Not enough categories"})
+
+
+class TestStatsApi(TestCase):
+    def test_stats(self):
+        self.assertEqual(self.client.get("/api/stats").status_code, 401)
+        with override_settings(METRICS_TOKEN="secret"):
+            response = self.client.get(
+                "/api/stats", headers={"Authorization": "Bearer secret"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("connections", response.json()["http"])
+
+
+class TestCamsApi(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+
+    def test_cams_is_rebuilt_after_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(title="Slovenia", color="#00ff00")
+            cam = Cam.objects.create(slug="piran", title="Piran", url="https://x")
+            cam.categories.add(category)
+        response = self.client.get("/api/cams.json")
+        self.assertEqual(response.json()["categories"][0]["cams"][0]["title"], "Piran")
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/cams.json")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cam.title = "Portorož"
+            cam.save()
+        response = self.client.get("/api/cams.json")
+        self.assertEqual(
+            response.json()["categories"][0]["cams"][0]["title"], "Portorož"
+        )
+
+    def test_cams_since_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(title="Slovenia", color="#00ff00")
+            piran = Cam.objects.create(slug="piran", title="Piran", url="https://x")
+            koper = Cam.objects.create(slug="koper", title="Koper", url="https://y")
+            piran.categories.add(category, through_defaults={"order": 0})
+            koper.categories.add(category, through_defaults={"order": 1})
+        snapshot = self.client.get("/api/cams.json?since=0").json()
+        self.assertTrue(snapshot["full"])
+        self.assertEqual(snapshot["categories"][0]["cams"], [piran.id, koper.id])
+        version = snapshot["version"]
+
+        self.client.get(f"/api/cams.json?since={version}")
+        with self.assertNumQueries(0):
+            unchanged = self.client.get(f"/api/cams.json?since={version}").json()
+        self.assertEqual(unchanged["version"], version)
+        self.assertEqual((unchanged["cams"], unchanged["categories"]), ([], []))
+
+        koper_id = koper.id
+        piran.offline_since = timezone.now()
+        async_to_sync(save_status)([piran])
+        with self.captureOnCommitCallbacks(execute=True):
+            CategoryCam.objects.filter(cam=koper).update(order=0)
+            CategoryCam.objects.get(cam=piran).save()
+            koper.delete()
+        delta = self.client.get(f"/api/cams.json?since={version}").json()
+        self.assertFalse(delta["full"])
+        self.assertEqual([cam["id"] for cam in delta["cams"]], [piran.id])
+        self.assertIsNotNone(delta["cams"][0]["offlineSince"])
+        self.assertEqual(delta["categories"][0]["cams"], [piran.id])
+        self.assertEqual(delta["removedCams"], [koper_id])
+
+        with override_settings(CATALOG_CHANGELOG_SIZE=1):
+            self.assertTrue(
+                self.client.get(f"/api/cams.json?since={version}").json()["full"]
+            )
+
+    def test_fast_json_matches_schema(self):
+        category = Category.objects.create(title="Slovenia", color="#00ff00")
+        for i in range(3):
+            cam = Cam.objects.create(slug=f"cam-{i}", title=f"Cam {i}", url="https://x")
+            cam.categories.add(category, through_defaults={"order": 3 - i})
+        Category.objects.create(title="Empty", color="#ff0000", order=1)
+        response = self.client.get("/api/cams.json")
+
+        catalog.invalidate()
+        with override_settings(API_FAST_JSON=True):
+            fast_response = self.client.get("/api/cams.json")
+        self.assertEqual(fast_response.json(), response.json())
+
+    def test_fast_renderer_matches_default(self):
+        data = {
+            "title": "Piran",
+            "offlineSince": datetime(2026, 1, 1, 8, 30, 15, 123456, tzinfo=UTC),
+            "cams": [1, 2],
+        }
+        expected = json.loads(JSONRenderer().render(None, data, response_status=200))
+        renderer = ORJSONRenderer()
+        self.assertEqual(
+            json.loads(renderer.render(None, data, response_status=200)), expected
+        )
+        with mock.patch("api.serialization.orjson", None):
+            self.assertEqual(
+                json.loads(renderer.render(None, data, response_status=200)), expected
+            )
+
+    def test_cams_gzip(self):
+        Category.objects.create(title="Slovenia", color="#00ff00")
+        response = self.client.get(
+            "/api/cams.json", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            gzip.decompress(response.content),
+            self.client.get("/api/cams.json").content,
+        )
+
+    def test_cams_not_modified(self):
+        Category.objects.create(title="Slovenia", color="#00ff00")
+        response = self.client.get("/api/cams.json")
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/cams.json", headers={"If-None-Match": response["ETag"]}
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+
+class TestCatalogChangelog(TransactionTestCase):
+    def test_rolled_back_changes_get_no_version(self):
+        with transaction.atomic():
+            Cam.objects.create(slug="piran", url="https://x")
+            transaction.set_rollback(True)
+        self.assertEqual(changelog.latest_version(), 0)
+        self.assertFalse(CatalogChange.objects.exists())
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_versions_follow_commit_order(self):
+        first_logged = threading.Event()
+        commit_first = threading.Event()
+        second_logged = threading.Event()
+
+        def first():
+            try:
+                with transaction.atomic():
+                    Cam.objects.create(slug="first", url="https://x")
+                    first_logged.set()
+                    commit_first.wait(5)
+            finally:
+                connection.close()
+
+        def second():
+            try:
+                Cam.objects.create(slug="second", url="https://y")
+                second_logged.set()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        threads[0].start()
+        first_logged.wait(5)
+        # The second cam gets the higher id but commits first, then waits for
+        # the first transaction to log its change
+        threads[1].start()
+        self.assertFalse(second_logged.wait(0.5))
+        self.assertEqual(changelog.latest_version(), 0)
+        commit_first.set()
+        for thread in threads:
+            thread.join(5)
+
+        first_id, second_id = (
+            Cam.objects.get(slug=slug).id for slug in ["first", "second"]
+        )
+        self.assertEqual(changelog.changes_since(1), (2, {second_id}, set()))
+        self.assertEqual(
+            list(CatalogChange.objects.values_list("object_id", "version")),
+            [(first_id, 1), (second_id, 2)],
+        )
+
+
+class TestForecastApi(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+        forecast_json_cache.clear()
+        forecast_cache.clear()
+        self.addCleanup(forecast_cache.clear)
+
+    def test_columnar_forecast(self):
+        cam = Cam.objects.create(slug="piran", url="https://x", spot_id="spot")
+        payloads = {
+            name: loads(content) for name, content in sample_payloads(3).items()
+        }
+        today = datetime.now(UTC).date()
+        forecast = {
+            "tides": parse_tides(payloads["tides"], today),
+            "sunlight": parse_sunlight(payloads["sunlight"], today),
+            "wind": parse_wind(payloads["wind"]),
+            "waves": parse_waves(payloads["waves"]),
+        }
+
+        async def fetch(endpoint, spot_id):
+            return forecast[endpoint]
+
+        with (
+            mock.patch.object(forecast_cache, "fetch", fetch),
+            mock.patch(
+                "api.urls.forecast_payload", wraps=forecast_payload
+            ) as build_payload,
+        ):
+            response = self.client.get(f"/api/cams/{cam.id}/forecast")
+            not_modified = self.client.get(
+                f"/api/cams/{cam.id}/forecast",
+                headers={"If-None-Match": response["ETag"]},
+            )
+        data = response.json()
+        self.assertEqual(data["tideUnit"], "m")
+        self.assertEqual(data["enums"]["tideType"], ["HIGH", "NORMAL"])
+        day = data["days"][0]
+        self.assertEqual(day["date"], today.isoformat())
+        self.assertEqual(day["sunlight"]["sunrise"], 7 * 60)
+        # 3-hourly rows from 6:00
+        self.assertEqual(
+            day["conditions"]["minutes"], [h * 60 for h in range(6, 24, 3)]
+        )
+        self.assertEqual(len(set(map(len, day["conditions"].values()))), 1)
+        self.assertEqual(len(day["tides"]["height"]), len(day["tides"]["type"]))
+        self.assertEqual(not_modified.status_code, 304)
+        # Built once, on the cold fetch
+        self.assertEqual(build_payload.call_count, 1)
+
+
+class TestSharedSnapshot(TestCase):
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        settings = override_settings(
+            CATALOG_SNAPSHOT_DIR=directory, CATALOG_SNAPSHOT_POLL_SECONDS=0
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.other_worker = SharedCatalog(directory)
+        catalog.invalidate()
+
+    def test_changes_from_other_workers_are_picked_up(self):
+        category = Category.objects.create(title="Slovenia", color="#00ff00")
+        cam = Cam.objects.create(
+            slug="piran", title="Piran", url="https://x", offline_since=timezone.now()
+        )
+        cam.categories.add(category)
+        # Another worker commits the change, this one only sees the version bump
+        self.other_worker.bump()
+
+        response = self.client.get(
+            "/api/cams.json", headers={"Accept-Encoding": "gzip"}
+        )
+        payload = gzip.decompress(response.content)
+        self.assertIn(b"Piran", payload)
+        self.assertEqual(catalog.shared_snapshot().version, 2)
+        self.assertEqual(
+            get_index().cams_by_id[cam.id].offline_since, cam.offline_since
+        )
+
+        Cam.objects.filter(id=cam.id).update(title="Portorož")
+        self.other_worker.bump()
+        response = self.client.get("/api/cams.json")
+        self.assertEqual(
+            response.json()["categories"][0]["cams"][0]["title"], "Portorož"
+        )
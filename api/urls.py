@@ -1,13 +1,42 @@
-import httpx
+from datetime import UTC, datetime
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db.models import Prefetch
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import render
 from ninja import Field, NinjaAPI, Schema
 
+from api.forecast import forecast_payload
+from api.serialization import (
+    ORJSONRenderer,
+    cams_payload,
+    catalog_payload,
+    fetch_catalog_rows,
+)
+from cams import catalog, changelog
+from cams.index import aget_index
 from cams.models import Cam, Category
-from surfline.urls import SurflineFetcher
-
-api = NinjaAPI()
+from surfcamsapi.compression import ENCODINGS, CompressedPayload, body_cache
+from surfcamsapi.http import pool_stats
+from surfcamsapi.metrics import can_read_stats
+from surfcamsapi.playlists import playlist_cache
+from surfcamsapi.scheduler import cam_scheduler
+from surfcamsapi.segments import segment_store
+from surfline.cache import FragmentCache
+from surfline.urls import (
+    EMPTY_FORECAST,
+    FORECAST_ENDPOINTS,
+    ForecastUnavailable,
+    breakers,
+    fetch_forecast,
+    forecast_cache,
+    forecast_context,
+    fragment_cache,
+)
+
+api = NinjaAPI(renderer=ORJSONRenderer() if settings.API_FAST_JSON else None)
+# Columnar forecast JSON by spot_id, see cams_forecast()
+forecast_json_cache = FragmentCache()
 
 
 class CamSchema(Schema):
@@ -45,15 +74,76 @@ class CamsSchema(Schema):
     categories: list[CategoriesSchema]
 
 
-@api.get("/cams.json", response=CamsSchema)
-async def cams(request, ana: bool = False):
-    categories = [
-        cat
-        async for cat in Category.objects.all().prefetch_related(
+def render_cams_json() -> bytes:
+    if settings.API_FAST_JSON:
+        data = cams_payload(*fetch_catalog_rows())
+    else:
+        categories = Category.objects.all().prefetch_related(
             Prefetch("cam_set", queryset=Cam.objects.order_by("categorycam__order"))
         )
-    ]
-    return {"categories": list(categories)}
+        data = CamsSchema.model_validate({"categories": list(categories)}).model_dump()
+    body = api.renderer.render(None, data, response_status=200)
+    return body if isinstance(body, bytes) else body.encode()
+
+
+def build_cams_json() -> CompressedPayload:
+    content_type = "application/json; charset=utf-8"
+    if (snapshot := catalog.shared_snapshot()) is not None:
+        # Served straight from the shared memory-mapped file
+        return CompressedPayload(
+            snapshot.section("cams.json"),
+            content_type,
+            last_modified=catalog.last_modified(),
+            variants={
+                encoding: snapshot.section(f"cams.json.{encoding}")
+                for encoding in ENCODINGS
+                if f"cams.json.{encoding}" in snapshot
+            },
+        )
+    return CompressedPayload(
+        render_cams_json(), content_type, last_modified=catalog.last_modified()
+    )
+
+
+def build_catalog_snapshot() -> CompressedPayload:
+    body = api.renderer.render(
+        None, catalog_payload(changelog.latest_version()), response_status=200
+    )
+    return CompressedPayload(
+        body if isinstance(body, bytes) else body.encode(),
+        "application/json; charset=utf-8",
+        last_modified=catalog.last_modified(),
+    )
+
+
+def catalog_changes(since: int) -> dict | CompressedPayload:
+    if (changes := changelog.changes_since(since)) is None:
+        return catalog.get_cached("catalog.json", build_catalog_snapshot)
+    return catalog_payload(*changes)
+
+
+@api.get("/cams.json", response=CamsSchema)
+async def cams(request, ana: bool = False, since: int | None = None):
+    if since is not None:
+        return await cams_since(request, since)
+    payload = await catalog.aget_cached("cams.json", build_cams_json)
+    return payload.response(request)
+
+
+async def cams_since(request, since: int):
+    """
+    The cams and categories changed after catalog version ``since``, or a full
+    snapshot when it's too old for a delta (or 0, to start from scratch).
+    """
+    version = await catalog.aget_cached("catalog.version", changelog.latest_version)
+    if since and since == version:
+        # What most polls get, without a database query
+        data = catalog_payload(version, cam_ids=(), category_ids=())
+    else:
+        data = await sync_to_async(catalog_changes)(since)
+        if isinstance(data, CompressedPayload):
+            return data.response(request)
+    return api.create_response(request, data, status=200)
 
 
 @api.get("/health", response=HealthSchema)
@@ -62,23 +152,84 @@ async def health(request):
     return {"message": "ok"}
 
 
+def cache_stats() -> dict:
+    return {
+        "compression": body_cache.stats(),
+        "forecast": forecast_cache.stats(),
+        "forecast_fragments": fragment_cache.stats(),
+        "forecast_json": forecast_json_cache.stats(),
+        "playlists": playlist_cache.stats(),
+        "segments": segment_store.stats(),
+    }
+
+
+@api.get("/stats")
+async def stats(request):
+    # Internal hosts and state, as private as /metrics
+    if not await can_read_stats(request):
+        return api.create_response(request, {"message": "Unauthorized"}, status=401)
+    return {
+        "http": pool_stats(),
+        **cache_stats(),
+        "cam_checks": cam_scheduler.stats(),
+        "surfline_breakers": {
+            name: breaker.stats() for name, breaker in breakers.items()
+        },
+    }
+
+
 @api.get("/cams/{cam_id}")
 async def cams_detail(request, cam_id: int):
-    try:
-        cam = await Cam.objects.aget(id=cam_id)
-    except Cam.DoesNotExist:
+    index = await aget_index()
+    if (cam := index.cams_by_id.get(cam_id)) is None:
         return api.create_response(request, {"message": "Cam not found"}, status=404)
-    async with httpx.AsyncClient() as client:
-        fetcher = SurflineFetcher(cam.spot_id, client)
-        tides, sunlight, wind, waves = await fetcher.fetch_all()
+    try:
+        tides, sunlight, wind, waves = await fetch_forecast(cam.spot_id)
+    except ForecastUnavailable:
+        tides, sunlight, wind, waves = EMPTY_FORECAST
 
     return render(
         request,
         "detail.html",
         {
-            "cam": cam,
+            **forecast_context(cam),
             "tides": tides,
             "sunlight": sunlight,
             "wind_and_waves": zip(wind, waves),
         },
     )
+
+
+@api.get("/cams/{cam_id}/forecast")
+async def cams_forecast(request, cam_id: int):
+    index = await aget_index()
+    if (cam := index.cams_by_id.get(cam_id)) is None:
+        return api.create_response(request, {"message": "Cam not found"}, status=404)
+    try:
+        forecast = await fetch_forecast(cam.spot_id)
+    except ForecastUnavailable:
+        return api.create_response(
+            request, {"message": "Please retry later"}, status=503
+        )
+    etag, last_modified = forecast_cache.validator(cam.spot_id)
+    now = datetime.now(UTC)
+    # Rebuilt every hour as well, for the day boundaries
+    version = f"{etag}-{now:%Y%m%d%H}"
+    if (payload := forecast_json_cache.get(cam.spot_id, version)) is None:
+        data = forecast_payload(now.date(), *forecast)
+        payload = CompressedPayload(
+            ORJSONRenderer().render(request, data, response_status=200),
+            "application/json; charset=utf-8",
+            last_modified,
+            etag=version,
+        )
+        # Only keep it if the validator is the data's, see get_surfline_section()
+        if forecast_cache.holds(cam.spot_id, FORECAST_ENDPOINTS, forecast):
+            forecast_json_cache.set(cam.spot_id, version, payload)
+    # Fresh until the end of the hour or the first endpoint expiring, stale
+    # fallback data has already expired and gets revalidated
+    max_age = min(
+        3600 - now.minute * 60 - now.second,
+        *(forecast_cache.expires_in(e, cam.spot_id) for e in FORECAST_ENDPOINTS),
+    )
+    return payload.response(request, cache_control=f"max-age={int(max(0, max_age))}")
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CamsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "cams"
+
+    def ready(self):
+        from cams import signals  # noqa: F401
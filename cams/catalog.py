@@ -0,0 +1,87 @@
+"""
+In-memory snapshots derived from the catalog (categories, cams and their order).
+
+The catalog only changes through the admin and ``import_json``, so anything
+built from it is kept until the next committed change to ``Cam``,
+``Category`` or ``CategoryCam`` (see ``cams.changelog``). Other workers learn
+about changes through the shared snapshot in ``CATALOG_SNAPSHOT_DIR`` (see
+``cams.snapshots``) when it is set.
+"""
+
+import time
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from cams.snapshots import SharedCatalog, SnapshotFile
+
+_version = 0
+_changed_at = time.time()
+_snapshots: dict[str, object] = {}
+_shared: SharedCatalog | None = None
+
+
+def version() -> int:
+    return _version
+
+
+def last_modified() -> float:
+    """When this process last saw the catalog change (or started)."""
+    return _changed_at
+
+
+def shared() -> SharedCatalog | None:
+    global _shared
+    directory = settings.CATALOG_SNAPSHOT_DIR
+    if not directory:
+        return None
+    if _shared is None or _shared.directory != Path(directory):
+        _shared = SharedCatalog(directory, settings.CATALOG_SNAPSHOT_POLL_SECONDS)
+    return _shared
+
+
+def shared_snapshot() -> SnapshotFile | None:
+    """The memory-mapped snapshot of the current catalog, if sharing is enabled."""
+    if (shared_catalog := shared()) is None:
+        return None
+    return shared_catalog.snapshot()
+
+
+def _clear():
+    global _version, _changed_at
+    _version += 1
+    _changed_at = time.time()
+    _snapshots.clear()
+
+
+def invalidate():
+    _clear()
+    if (shared_catalog := shared()) is not None:
+        shared_catalog.bump()
+
+
+def refresh():
+    """Drop our snapshots if another process changed the catalog."""
+    if (shared_catalog := shared()) is not None and shared_catalog.changed():
+        _clear()
+
+
+def get_cached(name: str, build):
+    """Return ``build()``, cached until the catalog changes."""
+    refresh()
+    snapshot = _snapshots.get(name)
+    if snapshot is None:
+        version = _version
+        snapshot = build()
+        # Don't keep a snapshot if the catalog changed while it was built
+        if version == _version:
+            _snapshots[name] = snapshot
+    return snapshot
+
+
+async def aget_cached(name: str, build):
+    refresh()
+    if (snapshot := _snapshots.get(name)) is not None:
+        return snapshot
+    return await sync_to_async(get_cached)(name, build)
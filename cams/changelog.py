@@ -0,0 +1,74 @@
+"""
+Catalog versions for the delta feed of ``/api/cams.json?since=<version>``.
+
+Every change to a cam or category (including which cams it has and their
+order) is logged as a ``CatalogChange`` in the same transaction as the change
+itself, so rolled back changes are never logged and committed ones always
+are. Only the last ``CATALOG_CHANGELOG_SIZE`` versions are kept, clients with
+an older cursor get a full snapshot instead.
+
+Versions come from the ``CatalogVersion`` row, which stays locked until the
+transaction commits. Transactions that change the catalog therefore commit in
+version order, and a client that has seen a version can't miss a change that
+commits later with a lower one.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from cams import catalog
+from cams.models import CatalogChange, CatalogVersion
+
+
+def _next_version() -> int:
+    counter, _ = CatalogVersion.objects.select_for_update().get_or_create(
+        pk=CatalogVersion.SINGLETON
+    )
+    counter.version += 1
+    counter.save(update_fields=["version"])
+    return counter.version
+
+
+def record(cams=(), categories=()):
+    """Log the cams and categories (by id) changed in the current transaction."""
+    changes = [
+        *((CatalogChange.CAM, pk) for pk in set(cams)),
+        *((CatalogChange.CATEGORY, pk) for pk in set(categories)),
+    ]
+    if not changes:
+        return
+    with transaction.atomic(savepoint=False):
+        version = _next_version()
+        CatalogChange.objects.bulk_create(
+            CatalogChange(kind=kind, object_id=pk, version=version)
+            for kind, pk in changes
+        )
+        CatalogChange.objects.filter(
+            version__lte=version - settings.CATALOG_CHANGELOG_SIZE
+        ).delete()
+        transaction.on_commit(catalog.invalidate)
+
+
+def latest_version() -> int:
+    return (
+        CatalogVersion.objects.filter(pk=CatalogVersion.SINGLETON)
+        .values_list("version", flat=True)
+        .first()
+        or 0
+    )
+
+
+def changes_since(since: int) -> tuple[int, set[int], set[int]] | None:
+    """
+    The current version and the ids of the cams and categories changed after
+    ``since``, or None if ``since`` is too old (or unknown) for a delta.
+    """
+    version = latest_version()
+    if not 0 < since <= version or since < version - settings.CATALOG_CHANGELOG_SIZE:
+        return None
+    cams, categories = set(), set()
+    for kind, object_id in CatalogChange.objects.filter(
+        version__gt=since, version__lte=version
+    ).values_list("kind", "object_id"):
+        (cams if kind == CatalogChange.CAM else categories).add(object_id)
+    return version, cams, categories
@@ -0,0 +1,89 @@
+"""
+Immutable in-memory index of the catalog for the page views.
+
+The index is a ``cams.catalog`` snapshot: it's built on first use after a
+catalog change, from the shared snapshot file when there is one and with
+three queries otherwise, and then replaced as a whole, so views look cams,
+categories and related cams up without touching the database.
+"""
+
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Self
+
+from cams import catalog
+from cams.models import Cam, Category
+from cams.snapshots import catalog_rows
+
+
+@dataclass(frozen=True)
+class CatalogIndex:
+    cams_by_id: MappingProxyType
+    cams_by_slug: MappingProxyType
+    # (category, its cams) in display order
+    categories: tuple[tuple[Category, tuple[Cam, ...]], ...]
+    related: MappingProxyType
+
+    @classmethod
+    def build(cls) -> Self:
+        if (snapshot := catalog.shared_snapshot()) is not None:
+            return cls.from_rows(json.loads(bytes(snapshot.section("rows"))))
+        return cls.from_rows(catalog_rows())
+
+    @classmethod
+    def from_rows(cls, rows: dict) -> Self:
+        """Build the index from ``cams.snapshots.catalog_rows()`` output."""
+        cam_fields = [Cam._meta.get_field(name) for name in rows["cam_fields"]]
+        cams_by_id = {}
+        for values in rows["cams"]:
+            cam = Cam.from_db(
+                "default",
+                rows["cam_fields"],
+                # Parses values that went through JSON, like offline_since
+                [field.to_python(value) for field, value in zip(cam_fields, values)],
+            )
+            cams_by_id[cam.id] = cam
+        category_cams = {}
+        for category_id, cam_id in rows["category_cams"]:
+            category_cams.setdefault(category_id, []).append(cams_by_id[cam_id])
+        categories = tuple(
+            (category, tuple(category_cams.get(category.id, ())))
+            for category in (
+                Category.from_db("default", ("id", "title", "color", "order"), row)
+                for row in rows["categories"]
+            )
+        )
+        # Same as Cam.related_cams(): the cams of every category of the cam
+        related = {}
+        for _, cams in categories:
+            for cam in set(cams):
+                related.setdefault(cam.id, []).extend(cams)
+        return cls(
+            cams_by_id=MappingProxyType(cams_by_id),
+            cams_by_slug=MappingProxyType(
+                {cam.slug: cam for cam in cams_by_id.values()}
+            ),
+            categories=categories,
+            related=MappingProxyType(
+                {cam_id: tuple(cams) for cam_id, cams in related.items()}
+            ),
+        )
+
+    def get_cam(self, slug_or_id: str) -> Cam | None:
+        if (cam := self.cams_by_slug.get(slug_or_id)) is not None:
+            return cam
+        if slug_or_id.isdigit():
+            return self.cams_by_id.get(int(slug_or_id))
+        return None
+
+    def related_cams(self, cam: Cam) -> tuple[Cam, ...]:
+        return self.related.get(cam.id, ())
+
+
+def get_index() -> CatalogIndex:
+    return catalog.get_cached("index", CatalogIndex.build)
+
+
+async def aget_index() -> CatalogIndex:
+    return await catalog.aget_cached("index", CatalogIndex.build)
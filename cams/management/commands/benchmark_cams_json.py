@@ -0,0 +1,91 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+from ninja.renderers import JSONRenderer
+
+from api.serialization import ORJSONRenderer, cams_payload, fetch_catalog_rows
+from api.urls import CamsSchema
+from cams.models import Cam, Category, CategoryCam
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the default and fast /api/cams.json serialization. "
+        "Test data is created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cams", type=int, nargs="+", default=[100, 1000, 10000])
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, cams, categories, repeat, **options):
+        self.stdout.write(
+            f"{'cams':>6} {'serializer':<10} {'ms':>9} {'peak KiB':>10} {'bytes':>10}"
+        )
+        for count in cams:
+            try:
+                with transaction.atomic():
+                    self.create_catalog(count, categories)
+                    self.compare(count, repeat)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def create_catalog(self, count: int, category_count: int):
+        category_list = Category.objects.bulk_create(
+            Category(title=f"Category {i}", color="#00ff00", order=i)
+            for i in range(category_count)
+        )
+        cam_list = Cam.objects.bulk_create(
+            Cam(
+                slug=f"benchmark-{i}",
+                title=f"Cam {i}",
+                subtitle="Surfline",
+                url=f"https://cams.example.com/{i}/playlist.m3u8",
+            )
+            for i in range(count)
+        )
+        CategoryCam.objects.bulk_create(
+            CategoryCam(category=category_list[i % category_count], cam=cam, order=i)
+            for i, cam in enumerate(cam_list)
+        )
+
+    def compare(self, count: int, repeat: int):
+        categories = list(
+            Category.objects.prefetch_related(
+                Prefetch("cam_set", queryset=Cam.objects.order_by("categorycam__order"))
+            )
+        )
+        rows = fetch_catalog_rows()
+        default_renderer = JSONRenderer()
+        fast_renderer = ORJSONRenderer()
+
+        def default():
+            data = CamsSchema.model_validate({"categories": categories}).model_dump()
+            return default_renderer.render(None, data, response_status=200).encode()
+
+        def fast():
+            return fast_renderer.render(None, cams_payload(*rows), response_status=200)
+
+        for name, serialize in (("default", default), ("fast", fast)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                body = serialize()
+                best = min(best, time.perf_counter() - start)
+            tracemalloc.start()
+            serialize()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(
+                f"{count:>6} {name:<10} {best * 1000:>9.2f} {peak / 1024:>10.0f} "
+                f"{len(body):>10}"
+            )
@@ -0,0 +1,127 @@
+import json
+import random
+import time
+from datetime import UTC, datetime
+
+from django.core.management.base import BaseCommand
+
+from surfline.parsers import (
+    loads,
+    parse_sunlight,
+    parse_tides,
+    parse_waves,
+    parse_wind,
+)
+
+HOUR = 3600
+DIRECTION_TYPES = ("Onshore", "Cross-shore", "Offshore")
+
+
+def sample_payloads(days: int, utc_offset: int = 1) -> dict[str, bytes]:
+    """Hourly Surfline-shaped responses starting at today's (local) midnight."""
+    rng = random.Random(0)
+    start = int(datetime.now(UTC).timestamp()) // 86400 * 86400 - utc_offset * HOUR
+    hours = [start + hour * HOUR for hour in range(days * 24)]
+    wind = [
+        {
+            "timestamp": ts,
+            "utcOffset": utc_offset,
+            "direction": rng.uniform(0, 360),
+            "directionType": rng.choice(DIRECTION_TYPES),
+            "speed": rng.uniform(0, 30),
+            "gust": rng.uniform(0, 40),
+            "optimalScore": rng.randint(0, 2),
+        }
+        for ts in hours
+    ]
+    wave = [
+        {
+            "timestamp": ts,
+            "utcOffset": utc_offset,
+            "surf": {
+                "min": rng.uniform(0, 1),
+                "max": rng.uniform(1, 3),
+                "humanRelation": "Waist to chest",
+                "optimalScore": rng.randint(0, 2),
+            },
+            "swells": [
+                {
+                    "height": rng.uniform(0, 3),
+                    "period": rng.randint(4, 18),
+                    "direction": rng.uniform(0, 360),
+                    "impact": rng.random(),
+                }
+                for _ in range(6)
+            ],
+            "power": rng.uniform(0, 500),
+        }
+        for ts in hours
+    ]
+    tides = [
+        {
+            "timestamp": ts,
+            "utcOffset": utc_offset,
+            "height": rng.uniform(0, 4),
+            "type": "HIGH" if i % 6 == 0 else "NORMAL",
+        }
+        for i, ts in enumerate(hours + [hours[-1] + HOUR * i for i in range(1, 25)])
+    ]
+    sunlight = [
+        {
+            **{
+                event: start + day * 86400 + hour * HOUR
+                for event, hour in (
+                    ("dawn", 6),
+                    ("sunrise", 7),
+                    ("sunset", 19),
+                    ("dusk", 20),
+                )
+            },
+            **{
+                f"{event}UTCOffset": utc_offset
+                for event in ("dawn", "sunrise", "sunset", "dusk")
+            },
+        }
+        for day in range(days)
+    ]
+    return {
+        "tides": json.dumps(
+            {
+                "associated": {"units": {"tideHeight": "M"}},
+                "data": {"tides": tides},
+            }
+        ).encode(),
+        "sunlight": json.dumps({"data": {"sunlight": sunlight}}).encode(),
+        "wind": json.dumps({"data": {"wind": wind}}).encode(),
+        "waves": json.dumps({"data": {"wave": wave}}).encode(),
+    }
+
+
+class Command(BaseCommand):
+    help = "Times decoding and parsing of synthetic Surfline forecast responses."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=1000)
+
+    def handle(self, *args, days, repeat, **options):
+        payloads = sample_payloads(days)
+        today = datetime.now(UTC).date()
+        parsers = {
+            "tides": lambda payload: parse_tides(payload, today),
+            "sunlight": lambda payload: parse_sunlight(payload, today),
+            "wind": parse_wind,
+            "waves": parse_waves,
+        }
+        self.stdout.write(f"{'endpoint':<10} {'bytes':>8} {'µs':>9}")
+        total = 0.0
+        for endpoint, parse in parsers.items():
+            content = payloads[endpoint]
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parse(loads(content))
+                best = min(best, time.perf_counter() - start)
+            total += best
+            self.stdout.write(f"{endpoint:<10} {len(content):>8} {best * 1e6:>9.1f}")
+        self.stdout.write(f"{'total':<10} {'':>8} {total * 1e6:>9.1f}")
@@ -1,8 +1,263 @@
 import json
+from collections.abc import Iterator
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
 
-from cams.models import Cam, Category
+from cams import changelog
+from cams.models import Cam, Category, CategoryCam
+
+# Cam fields set from the JSON file, the rest (slug, proxy, spot_id,
+# offline_since) is kept as it is
+CAM_FIELDS = {
+    "title": "title",
+    "subtitle": "subTitle",
+    "url": "url",
+    "title_color": "titleColor",
+    "subtitle_color": "subTitleColor",
+    "background_color": "backgroundColor",
+}
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\r\n"
+
+
+class JSONStream:
+    """A JSON document read in chunks and decoded one value at a time."""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        # Characters already dropped from the buffer, for error positions
+        self.offset = 0
+
+    def read(self, size: int) -> bool:
+        if not (chunk := self.f.read(size)):
+            return False
+        self.offset += self.position
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character after whitespace, "" at the end of the file."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read(self.chunk_size):
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise self.error(f"Expecting {char!r}", self.position)
+        self.position += 1
+
+    def decode(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as exc:
+                if not self.truncated(exc) or not self.read(size):
+                    raise self.error(exc.msg, exc.pos) from exc
+            else:
+                # A number may go on in the next chunk, like the 1 of "1." + "5"
+                if end < len(self.buffer) - 2 or not self.read(size):
+                    self.position = end
+                    return value
+            # Read twice as much on each retry, so that a value spanning many
+            # chunks is decoded a few times rather than once per chunk
+            size *= 2
+
+    def truncated(self, exc: json.JSONDecodeError) -> bool:
+        """Whether the error may just be the buffer ending mid-value."""
+        # The longest token that can be cut off is a \uXXXX escape
+        return len(self.buffer) - exc.pos <= 6 or exc.msg.startswith(
+            "Unterminated string"
+        )
+
+    def error(self, message: str, position: int) -> CommandError:
+        return CommandError(
+            f"Invalid JSON file: {message} at char {self.offset + position}"
+        )
+
+
+def iter_categories(f, chunk_size=CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Yield the items of the top-level ``categories`` array one at a time.
+
+    The file is read in chunks, so only the category being decoded has to fit
+    in memory rather than the whole document. The other top-level values are
+    decoded whole to skip them.
+    """
+    stream = JSONStream(f, chunk_size)
+    stream.expect("{")
+    while stream.peek() == '"':
+        key = stream.decode()
+        stream.expect(":")
+        if key == "categories":
+            yield from iter_array(stream)
+            return
+        stream.decode()
+        if stream.peek() != ",":
+            break
+        stream.expect(",")
+    stream.expect("}")
+    raise CommandError('No "categories" array in the JSON file')
+
+
+def iter_array(stream: JSONStream) -> Iterator:
+    stream.expect("[")
+    if stream.peek() == "]":
+        return
+    while True:
+        yield stream.decode()
+        if stream.peek() == "]":
+            return
+        stream.expect(",")
+
+
+class Upsert:
+    """
+    Diff the catalog in the JSON file against the database and apply it in bulk.
+
+    Categories are matched by title and cams by slug when the file has one,
+    by URL otherwise.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        cams = list(Cam.objects.all())
+        self.cams_by_slug = {cam.slug: cam for cam in cams}
+        self.cams_by_url = {cam.url: cam for cam in cams}
+        self.categories = {
+            category.title: category for category in Category.objects.all()
+        }
+        self.new_cams: list[Cam] = []
+        self.changed_cams: dict[int, Cam] = {}
+        self.new_categories: list[Category] = []
+        self.changed_categories: list[Category] = []
+        # (category, its cams in order) as in the file
+        self.members: list[tuple[Category, list[Cam]]] = []
+
+    def add_category(self, order: int, data: dict):
+        category = self.categories.get(data["title"])
+        if category is None:
+            category = Category(title=data["title"], color=data["color"], order=order)
+            self.categories[category.title] = category
+            self.new_categories.append(category)
+        elif (category.color, category.order) != (data["color"], order):
+            category.color = data["color"]
+            category.order = order
+            self.changed_categories.append(category)
+        cams = []
+        for cam_data in data["cams"]:
+            cam = self.add_cam(cam_data)
+            if cam not in cams:
+                cams.append(cam)
+        self.members.append((category, cams))
+
+    def add_cam(self, data: dict) -> Cam:
+        values = {field: data[key] for field, key in CAM_FIELDS.items()}
+        if "slug" in data:
+            cam = self.cams_by_slug.get(data["slug"])
+        else:
+            cam = self.cams_by_url.get(values["url"])
+        if cam is None:
+            cam = Cam(slug=data.get("slug") or self.unique_slug(values["title"]))
+            for field, value in values.items():
+                setattr(cam, field, value)
+            self.new_cams.append(cam)
+        elif any(getattr(cam, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(cam, field, value)
+            if cam.pk is not None:
+                self.changed_cams[cam.pk] = cam
+        self.cams_by_slug[cam.slug] = cam
+        self.cams_by_url[cam.url] = cam
+        return cam
+
+    def unique_slug(self, title: str) -> str:
+        base = slug = slugify(title) or "cam"
+        suffix = 2
+        while slug in self.cams_by_slug:
+            slug = f"{base}-{suffix}"
+            suffix += 1
+        return slug
+
+    def save(self, prune: bool) -> dict[str, int]:
+        Category.objects.bulk_create(self.new_categories, batch_size=self.batch_size)
+        Category.objects.bulk_update(
+            self.changed_categories, ["color", "order"], batch_size=self.batch_size
+        )
+        Cam.objects.bulk_create(self.new_cams, batch_size=self.batch_size)
+        Cam.objects.bulk_update(
+            self.changed_cams.values(), list(CAM_FIELDS), batch_size=self.batch_size
+        )
+        changelog.record(
+            cams=[cam.pk for cam in [*self.new_cams, *self.changed_cams.values()]],
+            categories=[
+                category.pk
+                for category in [*self.new_categories, *self.changed_categories]
+            ],
+        )
+        counts = {
+            "categories created": len(self.new_categories),
+            "categories updated": len(self.changed_categories),
+            "cams created": len(self.new_cams),
+            "cams updated": len(self.changed_cams),
+            **self.save_members(),
+        }
+        if prune:
+            categories = [category.pk for category, _ in self.members]
+            cams = {cam.pk for _, members in self.members for cam in members}
+            _, deleted = Category.objects.exclude(pk__in=categories).delete()
+            counts["categories deleted"] = deleted.get("cams.Category", 0)
+            _, deleted = Cam.objects.exclude(pk__in=cams).delete()
+            counts["cams deleted"] = deleted.get("cams.Cam", 0)
+        return counts
+
+    def save_members(self) -> dict[str, int]:
+        """Create, reorder and remove only the CategoryCam rows that changed."""
+        existing = {
+            (member.category_id, member.cam_id): member
+            for member in CategoryCam.objects.filter(
+                category__in=[category for category, _ in self.members]
+            )
+        }
+        new = []
+        changed = []
+        for category, cams in self.members:
+            for order, cam in enumerate(cams):
+                member = existing.pop((category.pk, cam.pk), None)
+                if member is None:
+                    new.append(CategoryCam(category=category, cam=cam, order=order))
+                elif member.order != order:
+                    member.order = order
+                    changed.append(member)
+        CategoryCam.objects.bulk_create(new, batch_size=self.batch_size)
+        CategoryCam.objects.bulk_update(changed, ["order"], batch_size=self.batch_size)
+        # Bulk operations don't send signals, unlike the deletes below
+        changelog.record(categories=[member.category_id for member in [*new, *changed]])
+        removed = [member.pk for member in existing.values()]
+        for start in range(0, len(removed), self.batch_size):
+            CategoryCam.objects.filter(
+                pk__in=removed[start : start + self.batch_size]
+            ).delete()
+        return {
+            "memberships created": len(new),
+            "memberships reordered": len(changed),
+            "memberships removed": len(removed),
+        }
 
 
 class Command(BaseCommand):
@@ -10,11 +265,27 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("json_file", type=str)
+        parser.add_argument(
+            "--upsert",
+            action="store_true",
+            help="Update the catalog in place in one transaction instead of "
+            "deleting and recreating it, keeping slugs and cam state",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="With --upsert, delete categories and cams missing from the file",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
 
     def handle(self, *args, json_file: str | None = None, **options):
         if not json_file:
             raise CommandError("Please provide a JSON file")
 
+        if options["upsert"]:
+            self.upsert(json_file, options["prune"], options["batch_size"])
+            return
+
         with open(json_file) as f:
             cams_json = json.load(f)
 
@@ -45,3 +316,13 @@ class Command(BaseCommand):
                 cam_model.save()
                 cam_model.categories.add(category_model)
         self.stdout.write(self.style.SUCCESS("Done!"))
+
+    def upsert(self, json_file: str, prune: bool, batch_size: int):
+        with open(json_file) as f, transaction.atomic():
+            upsert = Upsert(batch_size)
+            for order, category in enumerate(iter_categories(f)):
+                upsert.add_category(order, category)
+            counts = upsert.save(prune)
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
+        self.stdout.write(self.style.SUCCESS("Done!"))
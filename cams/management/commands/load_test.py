@@ -0,0 +1,321 @@
+import asyncio
+import itertools
+import random
+import socket
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from cams import catalog
+from cams.management.commands.benchmark_surfline_parsers import sample_payloads
+from cams.models import Cam, Category, CategoryCam
+from surfcamsapi import segments
+from surfcamsapi.http import close_client
+
+SURFLINE_PATH = "/kbyg/spots/forecasts/"
+SURFLINE_ENDPOINTS = ("tides", "sunlight", "wind", "wave")
+SEGMENT_SECONDS = 6
+PLAYLIST_SEGMENTS = 3
+TARGETS = (
+    "cams.json",
+    "detail",
+    "surfline",
+    "tides",
+    "conditions",
+    "playlist",
+    "segment",
+)
+REASONS = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class StubUpstream:
+    """
+    Local HTTP/1.1 server standing in for Surfline and the cam CDNs.
+
+    Surfline endpoints replay recorded (or synthetic) responses, and
+    ``/hls/<cam>/`` serves a live playlist advancing every
+    ``SEGMENT_SECONDS`` with same-sized segments. Every response is delayed
+    by ``latency`` (±50%) and fails with a 503 with ``error_rate``.
+    """
+
+    def __init__(self, payloads, latency, error_rate, segment_size, seed):
+        self.payloads = payloads
+        self.latency = latency
+        self.error_rate = error_rate
+        self.segment = b"\x47" * segment_size
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.socket = socket.create_server(("127.0.0.1", 0))
+        self.host = f"127.0.0.1:{self.socket.getsockname()[1]}"
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, sock=self.socket)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        try:
+            while request_line := await reader.readline():
+                # Only GET and HEAD requests are sent, there are no bodies
+                while (await reader.readline()).strip():
+                    pass
+                method, target, _ = request_line.decode().split(" ", 2)
+                status, content_type, body = await self.respond(urlsplit(target).path)
+                head = (
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                )
+                writer.write(head.encode())
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            # Disconnected, malformed request, or shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, path: str) -> tuple[int, str, bytes]:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return 503, "text/plain", b"stub error"
+        if path.startswith(SURFLINE_PATH):
+            endpoint = path.removeprefix(SURFLINE_PATH)
+            if endpoint in self.payloads:
+                return 200, "application/json", self.payloads[endpoint]
+        elif path.startswith("/hls/"):
+            if path.endswith(".m3u8"):
+                return 200, "application/vnd.apple.mpegurl", self.playlist()
+            if path.endswith(".ts"):
+                return 200, "video/mp2t", self.segment
+        return 404, "text/plain", b"not found"
+
+    def playlist(self) -> bytes:
+        sequence = live_sequence()
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}",
+            f"#EXT-X-MEDIA-SEQUENCE:{sequence}",
+        ]
+        for number in range(sequence, sequence + PLAYLIST_SEGMENTS):
+            lines += [f"#EXTINF:{SEGMENT_SECONDS}.0,", f"{number}.ts"]
+        return ("\n".join(lines) + "\n").encode()
+
+
+def live_sequence() -> int:
+    return int(time.time()) // SEGMENT_SECONDS
+
+
+def load_payloads(recordings: Path | None) -> dict[str, bytes]:
+    """Surfline responses by endpoint, from ``<endpoint>.json`` files if given."""
+    if recordings is None:
+        payloads = sample_payloads(days=3)
+        payloads["wave"] = payloads.pop("waves")
+        return payloads
+    return {
+        endpoint: (recordings / f"{endpoint}.json").read_bytes()
+        for endpoint in SURFLINE_ENDPOINTS
+    }
+
+
+@contextmanager
+def temporary_segment_store():
+    """Cache the stub's segments in a throwaway directory, not the real one."""
+    store = segments.segment_store
+    with tempfile.TemporaryDirectory() as directory:
+        segments.segment_store = segments.SegmentStore(
+            directory, store.max_bytes, store.max_age
+        )
+        try:
+            yield
+        finally:
+            segments.segment_store = store
+
+
+def percentile(latencies: list[float], p: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[p - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the ASGI app against local Surfline and HLS stubs. "
+        "Test data is created in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--cams", type=int, default=20)
+        parser.add_argument(
+            "--targets", nargs="+", choices=TARGETS, default=list(TARGETS)
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.05, help="Upstream latency (s)"
+        )
+        parser.add_argument("--error-rate", type=float, default=0.0)
+        parser.add_argument("--segment-size", type=int, default=256 * 1024)
+        parser.add_argument(
+            "--recordings",
+            type=Path,
+            help="Directory with recorded tides/sunlight/wind/wave .json responses",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        upstream = StubUpstream(
+            load_payloads(options["recordings"]),
+            options["latency"],
+            options["error_rate"],
+            options["segment_size"],
+            options["seed"],
+        )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with (
+                override_settings(
+                    SURFLINE_BASE_URL=f"http://{upstream.host}{SURFLINE_PATH}",
+                    PROXY_UPSTREAM_SCHEME="http",
+                    # Don't publish the test catalog to the deployment's workers
+                    CATALOG_SNAPSHOT_DIR="",
+                ),
+                temporary_segment_store(),
+            ):
+                cams = self.create_catalog(upstream.host, options["cams"])
+                cookies = self.login()
+                latencies, errors, elapsed = asyncio.run(
+                    self.run(upstream, cams, cookies, options)
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.report(latencies, errors, elapsed)
+        self.stdout.write(
+            f"upstream: {upstream.requests} requests, {upstream.errors} injected errors"
+        )
+
+    def create_catalog(self, host: str, count: int) -> list[Cam]:
+        category = Category.objects.create(title="Load test", color="#00ff00")
+        cams = Cam.objects.bulk_create(
+            Cam(
+                slug=f"cam-{i}",
+                title=f"Cam {i}",
+                subtitle="Surfline",
+                url=f"http://{host}/hls/{i}/index.m3u8",
+                proxy=True,
+                spot_id=f"spot-{i}",
+            )
+            for i in range(count)
+        )
+        CategoryCam.objects.bulk_create(
+            CategoryCam(category=category, cam=cam, order=order)
+            for order, cam in enumerate(cams)
+        )
+        catalog.invalidate()
+        return cams
+
+    def login(self) -> dict[str, str]:
+        client = Client()
+        client.force_login(User.objects.create_user("load-test"))
+        return {name: morsel.value for name, morsel in client.cookies.items()}
+
+    def target_path(self, target: str, cam: Cam, host: str) -> str:
+        match target:
+            case "cams.json":
+                return "/api/cams.json"
+            case "detail":
+                return f"/cams/{cam.slug}/"
+            case "surfline":
+                return f"/surfline/{cam.id}/"
+            case "tides" | "conditions":
+                return f"/surfline/{cam.id}/{target}/"
+            case "playlist":
+                return f"/p/{host}/hls/{cam.id}/index.m3u8"
+            case "segment":
+                return f"/p/{host}/hls/{cam.id}/{live_sequence()}.ts"
+
+    async def run(self, upstream: StubUpstream, cams, cookies, options):
+        from surfcamsapi.asgi import application
+
+        rng = random.Random(options["seed"])
+        # Shared by the workers, each takes the next request when it's free
+        jobs = (
+            (target, rng.choice(cams))
+            for target in itertools.islice(
+                itertools.cycle(options["targets"]), options["requests"]
+            )
+        )
+        latencies = {target: [] for target in options["targets"]}
+        errors = dict.fromkeys(options["targets"], 0)
+
+        async def worker(client: httpx.AsyncClient):
+            for target, cam in jobs:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(
+                        self.target_path(target, cam, upstream.host)
+                    )
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                latencies[target].append(time.perf_counter() - start)
+                errors[target] += failed
+
+        asyncio.create_task(upstream.serve())
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=application),
+            base_url="http://testserver",
+            cookies=cookies,
+            timeout=None,
+        ) as client:
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(worker(client) for _ in range(options["concurrency"]))
+            )
+            elapsed = time.perf_counter() - start
+        # Forecast refreshes that outlived their requests, and the stub server
+        leftover = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in leftover:
+            task.cancel()
+        await asyncio.gather(*leftover, return_exceptions=True)
+        # Closing the app's upstream connections lets the stub handlers finish
+        await close_client()
+        return latencies, errors, elapsed
+
+    def report(self, latencies: dict, errors: dict, elapsed: float):
+        self.stdout.write(
+            f"{'target':<10} {'requests':>8} {'errors':>7} {'req/s':>8}"
+            f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        rows = [*latencies.items(), ("total", [*itertools.chain(*latencies.values())])]
+        for target, values in rows:
+            failed = sum(errors.values()) if target == "total" else errors[target]
+            self.stdout.write(
+                f"{target:<10} {len(values):>8} {failed:>7} {len(values) / elapsed:>8.1f}"
+                + "".join(
+                    f" {percentile(values, p) * 1000:>8.1f}" for p in (50, 95, 99)
+                )
+            )
+        self.stdout.write(f"elapsed: {elapsed:.2f}s")
@@ -44,7 +44,8 @@ class Cam(models.Model):
     @property
     def proxy_url(self) -> str:
         if self.proxy:
-            return reverse("proxy", kwargs={"url": self.url.replace("https://", "")})
+            prefix = f"{settings.PROXY_UPSTREAM_SCHEME}://"
+            return reverse("proxy", kwargs={"url": self.url.replace(prefix, "")})
         else:
             return self.url
 
@@ -94,3 +95,30 @@ class CategoryCam(models.Model):
 
     class Meta:
         ordering = ["order"]
+
+
+class CatalogChange(models.Model):
+    """
+    A cam or category that was created, changed or deleted.
+
+    ``version`` is the catalog version of the delta feed that it's part of,
+    see ``cams.changelog``. Changes to a category's cams are recorded as
+    changes to the category.
+    """
+
+    CAM = "cam"
+    CATEGORY = "category"
+
+    kind = models.CharField(
+        max_length=8, choices=[(CAM, "Cam"), (CATEGORY, "Category")]
+    )
+    object_id = models.BigIntegerField()
+    version = models.BigIntegerField(db_index=True)
+
+
+class CatalogVersion(models.Model):
+    """The current catalog version, a single row locked to assign the next one."""
+
+    SINGLETON = 1
+
+    version = models.BigIntegerField(default=0)
@@ -0,0 +1,35 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from cams import changelog
+from cams.models import Cam, Category, CategoryCam
+
+
+@receiver(post_save, sender=Cam)
+@receiver(post_delete, sender=Cam)
+def cam_changed(sender, instance, **kwargs):
+    changelog.record(cams=[instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    changelog.record(categories=[instance.pk])
+
+
+@receiver(post_save, sender=CategoryCam)
+@receiver(post_delete, sender=CategoryCam)
+def category_cam_changed(sender, instance, **kwargs):
+    # The cams of a category and their order are part of the category
+    changelog.record(categories=[instance.category_id])
+
+
+@receiver(m2m_changed, sender=CategoryCam)
+def categories_changed(sender, instance, action, pk_set, **kwargs):
+    if isinstance(instance, Category):
+        if action.startswith("post_"):
+            changelog.record(categories=[instance.pk])
+    elif action == "pre_clear":
+        changelog.record(categories=instance.categories.values_list("pk", flat=True))
+    elif action.startswith("post_") and action != "post_clear":
+        changelog.record(categories=pk_set)
@@ -0,0 +1,177 @@
+"""
+Catalog snapshots shared between worker processes.
+
+With ``CATALOG_SNAPSHOT_DIR`` set, every catalog change bumps a version
+counter in that directory. The first worker that needs the new version
+builds the snapshot file (catalog rows plus the rendered and compressed
+``cams.json``) under a lock and moves it into place atomically; the others
+memory-map it read-only, so they share its pages instead of each building
+and holding their own copy. Workers check the counter at most every
+``CATALOG_SNAPSHOT_POLL_SECONDS``.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from cams.models import Cam, Category, CategoryCam
+
+MAGIC = b"SURFCAT1"
+# magic, version, table of contents length
+HEADER = struct.Struct("<8sQI")
+
+
+class SnapshotFile:
+    """Read-only mapping of a snapshot file with named sections."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, toc_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        start = HEADER.size + toc_length
+        toc = json.loads(self._map[HEADER.size : start])
+        self._sections = {
+            name: (start + offset, length) for name, (offset, length) in toc.items()
+        }
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def section(self, name: str) -> memoryview:
+        # Views keep the mapping alive, so it is never closed explicitly
+        offset, length = self._sections[name]
+        return memoryview(self._map)[offset : offset + length]
+
+
+def write_snapshot(path: Path, version: int, sections: dict[str, bytes]):
+    toc = {}
+    offset = 0
+    for name, data in sections.items():
+        toc[name] = (offset, len(data))
+        offset += len(data)
+    encoded_toc = json.dumps(toc).encode()
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, version, len(encoded_toc)))
+        f.write(encoded_toc)
+        for data in sections.values():
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def catalog_rows() -> dict:
+    cam_fields = [field.attname for field in Cam._meta.concrete_fields]
+    return {
+        "categories": list(
+            Category.objects.order_by("order").values_list(
+                "id", "title", "color", "order"
+            )
+        ),
+        "cam_fields": cam_fields,
+        "cams": list(Cam.objects.values_list(*cam_fields)),
+        "category_cams": list(
+            CategoryCam.objects.order_by("order").values_list("category_id", "cam_id")
+        ),
+    }
+
+
+def build_sections() -> dict[str, bytes]:
+    from api.urls import render_cams_json
+    from surfcamsapi.compression import compress
+
+    body = render_cams_json()
+    sections = {
+        # offline_since is the only non-JSON value, parsed back by the index
+        "rows": json.dumps(catalog_rows(), default=datetime.isoformat).encode(),
+        "cams.json": body,
+    }
+    for encoding, compressed in compress(body).items():
+        sections[f"cams.json.{encoding}"] = compressed
+    return sections
+
+
+class SharedCatalog:
+    def __init__(self, directory, poll_interval=2.0, build=build_sections):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.build = build
+        self.version_path = self.directory / "version"
+        self.snapshot_path = self.directory / "catalog.snapshot"
+        self.version = self.read_version()
+        self._checked_at = time.monotonic()
+        self._snapshot: SnapshotFile | None = None
+
+    @contextmanager
+    def _locked(self, name: str):
+        fd = os.open(self.directory / f"{name}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def read_version(self) -> int:
+        try:
+            return int(self.version_path.read_text() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def bump(self) -> int:
+        """Record a catalog change for every process."""
+        with self._locked("version"):
+            version = self.read_version() + 1
+            tmp = self.version_path.with_name(f"version.{os.getpid()}.tmp")
+            tmp.write_text(str(version))
+            os.replace(tmp, self.version_path)
+        self.version = version
+        self._checked_at = time.monotonic()
+        return version
+
+    def changed(self) -> bool:
+        """Whether another process changed the catalog since we last looked."""
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_interval:
+            return False
+        self._checked_at = now
+        version = self.read_version()
+        if version == self.version:
+            return False
+        self.version = version
+        return True
+
+    def _open(self) -> SnapshotFile | None:
+        try:
+            return SnapshotFile(self.snapshot_path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _current(self, snapshot: SnapshotFile | None) -> bool:
+        return snapshot is not None and snapshot.version >= self.version
+
+    def snapshot(self) -> SnapshotFile:
+        """The snapshot of the current version, built here if nobody has yet."""
+        if self._current(self._snapshot):
+            return self._snapshot
+        snapshot = self._open()
+        if not self._current(snapshot):
+            with self._locked("build"):
+                snapshot = self._open()
+                if not self._current(snapshot):
+                    version = self.read_version()
+                    write_snapshot(self.snapshot_path, version, self.build())
+                    snapshot = self._open()
+        # A newer file than self.version is fine to use, changed() will still
+        # report the newer version so that everything else gets rebuilt too
+        self._snapshot = snapshot
+        return snapshot
@@ -1,5 +1,11 @@
+import os
+
 proc_name = "surfcams"
 bind = "unix:gunicorn.sock"
-workers = 1
+# The cam checks run in one elected worker (see surfcamsapi/leader.py), while
+# every worker prefetches forecasts into its own cache, so Surfline requests
+# grow with the number of workers. Set CATALOG_SNAPSHOT_DIR too when running
+# more than one (see cams/snapshots.py).
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
 threads = 4
 worker_class = "uvicorn.workers.UvicornWorker"
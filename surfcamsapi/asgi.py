@@ -12,7 +12,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-from .scheduler import run_scheduler
+from . import http
+from .leader import run_as_leader
+from .scheduler import run_prefetcher, run_scheduler
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "surfcamsapi.settings")
 
@@ -21,15 +23,20 @@ django_application = get_asgi_application()
 
 async def application(scope, receive, send):
     if scope["type"] == "lifespan":
-        scheduler_task = None
+        tasks = []
         while True:
             message = await receive()
             if message["type"] == "lifespan.startup":
-                scheduler_task = asyncio.create_task(run_scheduler())
+                await http.start_client()
+                tasks = [
+                    asyncio.create_task(run_as_leader(run_scheduler)),
+                    asyncio.create_task(run_prefetcher()),
+                ]
                 await send({"type": "lifespan.startup.complete"})
             elif message["type"] == "lifespan.shutdown":
-                if scheduler_task is not None:
-                    scheduler_task.cancel()
+                for task in tasks:
+                    task.cancel()
+                await http.close_client()
                 await send({"type": "lifespan.shutdown.complete"})
                 return
     else:
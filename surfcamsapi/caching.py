@@ -0,0 +1,32 @@
+"""
+Conditional GET helpers.
+
+Views compute a validator (ETag and Last-Modified) from data they already
+hold in memory and answer ``If-None-Match``/``If-Modified-Since`` with a 304
+before doing any rendering or serialization.
+"""
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def not_modified(request, etag: str, last_modified: float | None = None):
+    """Return a 304 (or 412) response if the client's copy is current."""
+    response = get_conditional_response(
+        request,
+        etag=quote_etag(etag),
+        last_modified=int(last_modified) if last_modified is not None else None,
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(
+    response, etag: str, last_modified: float | None = None, cache_control="no-cache"
+):
+    response["ETag"] = quote_etag(etag)
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = cache_control
+    return response
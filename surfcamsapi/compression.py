@@ -0,0 +1,204 @@
+"""
+Precompressed response bodies.
+
+Payloads that are built once and served many times are compressed up front,
+so each request only picks the variant matching its ``Accept-Encoding``.
+Brotli is used when the optional ``brotli`` package is installed.
+
+``compression_middleware`` covers the remaining dynamic responses. It skips
+streamed responses (proxied video, files), already encoded ones and content
+types that don't compress, and keeps the compressed bytes of recent bodies,
+so a page rendered the same way again isn't recompressed. Private responses
+(``Cache-Control: private`` or ``no-store``, or varying on the cookie) can
+reflect secrets like CSRF tokens, so they are gzipped with random padding
+against BREACH, like ``GZipMiddleware`` does, and never cached.
+"""
+
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse
+from django.utils.cache import has_vary_header, patch_vary_headers
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.text import compress_string
+
+from surfcamsapi.caching import not_modified, set_validators
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Most preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+COMPRESSORS = {"gzip": lambda body: gzip.compress(body, mtime=0)}
+if brotli is not None:
+    COMPRESSORS["br"] = brotli.compress
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+# Smaller bodies rarely get smaller enough to be worth it
+MIN_COMPRESS_SIZE = 1024
+# Random bytes added to private gzipped bodies, as GZipMiddleware does
+BREACH_PADDING_BYTES = 100
+
+
+def compress(body: bytes) -> dict[str, bytes]:
+    return {encoding: COMPRESSORS[encoding](body) for encoding in ENCODINGS}
+
+
+def accepted_encodings(request) -> set[str]:
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, *params = (param.strip() for param in part.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+def negotiate(request, available) -> str | None:
+    accepted = accepted_encodings(request)
+    for encoding in ENCODINGS:
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+class CompressedPayload:
+    def __init__(
+        self,
+        body: bytes,
+        content_type: str,
+        last_modified: float | None = None,
+        etag: str | None = None,
+        variants: dict[str, bytes] | None = None,
+    ):
+        self.body = body
+        self.content_type = content_type
+        self.variants = variants if variants is not None else compress(body)
+        self.etag = etag or hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = last_modified if last_modified else time.time()
+
+    def response(self, request, cache_control="no-cache") -> HttpResponse:
+        encoding = negotiate(request, self.variants)
+        # Each representation gets its own strong ETag
+        etag = f"{self.etag}-{encoding}" if encoding else self.etag
+        response = not_modified(request, etag, self.last_modified)
+        if response is None:
+            response = HttpResponse(
+                self.variants[encoding] if encoding else self.body,
+                content_type=self.content_type,
+            )
+            if encoding:
+                response["Content-Encoding"] = encoding
+        set_validators(response, etag, self.last_modified, cache_control)
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+class CompressedBodyCache:
+    """Compressed variants of response bodies, keyed by ETag or content hash."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, body: bytes, encoding: str, etag: str | None = None) -> bytes:
+        version = etag or hashlib.sha256(body).digest()
+        key = (version, encoding)
+        if (compressed := self._entries.get(key)) is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compressed
+        self.misses += 1
+        compressed = COMPRESSORS[encoding](body)
+        self._entries[key] = compressed
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return compressed
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+body_cache = CompressedBodyCache()
+
+
+def is_private(response) -> bool:
+    cache_control = response.get("Cache-Control", "")
+    return (
+        "private" in cache_control
+        or "no-store" in cache_control
+        or has_vary_header(response, "Cookie")
+    )
+
+
+def should_compress(response) -> bool:
+    return (
+        not response.streaming
+        and response.status_code == 200
+        and not response.has_header("Content-Encoding")
+        and "no-transform" not in response.get("Cache-Control", "")
+        and response.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES)
+        and len(response.content) >= MIN_COMPRESS_SIZE
+    )
+
+
+def compress_response(request, response):
+    if not should_compress(response):
+        return response
+    patch_vary_headers(response, ("Accept-Encoding",))
+    # Only a strong ETag identifies the body
+    etag = response.get("ETag")
+    strong_etag = etag if etag and etag.startswith('"') else None
+    if is_private(response):
+        if (encoding := negotiate(request, ("gzip",))) is None:
+            return response
+        response.content = compress_string(
+            response.content, max_random_bytes=BREACH_PADDING_BYTES
+        )
+    else:
+        if (encoding := negotiate(request, COMPRESSORS)) is None:
+            return response
+        response.content = body_cache.get(response.content, encoding, strong_etag)
+    response["Content-Encoding"] = encoding
+    response["Content-Length"] = str(len(response.content))
+    if strong_etag:
+        # Like GZipMiddleware, the compressed body is only weakly equivalent
+        response["ETag"] = f"W/{strong_etag}"
+    return response
+
+
+@sync_and_async_middleware
+def compression_middleware(get_response):
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            return compress_response(request, await get_response(request))
+
+    else:
+
+        def middleware(request):
+            return compress_response(request, get_response(request))
+
+    return middleware
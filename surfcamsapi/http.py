@@ -0,0 +1,186 @@
+"""
+Process-wide pooled httpx client.
+
+The client is created on ``lifespan.startup`` in ``surfcamsapi.asgi`` and closed
+on shutdown, so connections to Surfline and the cam CDNs are kept alive and
+reused across requests and scheduler runs.
+"""
+
+import asyncio
+import logging
+from collections.abc import Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that frees the per-host slot once the body is closed."""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._released:
+            self._released = True
+            self._release()
+        await self._stream.aclose()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Wraps a transport and caps the number of concurrent requests per host."""
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, max_per_host: int):
+        self.transport = transport
+        self.max_per_host = max_per_host
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._in_flight: dict[str, int] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        # Waiting for a slot counts against the pool timeout, like waiting for
+        # a connection from the pool does
+        timeout = request.extensions.get("timeout", {}).get("pool")
+        try:
+            async with asyncio.timeout(timeout):
+                await semaphore.acquire()
+        except TimeoutError as exc:
+            raise httpx.PoolTimeout(
+                f"No free connection slot for {host}", request=request
+            ) from exc
+        self._in_flight[host] = self._in_flight.get(host, 0) + 1
+
+        def release():
+            semaphore.release()
+            if (count := self._in_flight[host] - 1) > 0:
+                self._in_flight[host] = count
+            else:
+                del self._in_flight[host]
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def in_flight(self) -> dict[str, int]:
+        return dict(self._in_flight)
+
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+_transport: HostLimitedTransport | None = None
+# Clients of a previous event loop being closed
+_closing: set[asyncio.Future] = set()
+
+
+def create_client() -> httpx.AsyncClient:
+    from django.conf import settings
+
+    global _transport
+    _transport = HostLimitedTransport(
+        httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=settings.HTTP2,
+        ),
+        max_per_host=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+    )
+    return httpx.AsyncClient(
+        transport=_transport,
+        timeout=httpx.Timeout(
+            settings.HTTP_READ_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+            pool=settings.HTTP_POOL_TIMEOUT,
+        ),
+    )
+
+
+async def start_client():
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = create_client()
+    _client_loop = asyncio.get_running_loop()
+
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the shared client.
+
+    Outside of the ASGI lifespan (runserver, management commands, tests) a
+    client is created lazily for the running event loop.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        if _client is not None and not _client.is_closed:
+            _discard(_client, _client_loop)
+        _client = create_client()
+        _client_loop = loop
+    return _client
+
+
+def _discard(client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop | None):
+    """Close a client created for another event loop, without waiting for it."""
+    if loop is not None and loop.is_running():
+        # Still running in another thread, close it there
+        future = asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    else:
+        future = asyncio.ensure_future(_aclose_quietly(client))
+    _closing.add(future)
+    future.add_done_callback(_closing.discard)
+
+
+async def _aclose_quietly(client: httpx.AsyncClient):
+    try:
+        await client.aclose()
+    except (httpx.HTTPError, OSError, RuntimeError):
+        logger.debug("Closing a stale HTTP client failed", exc_info=True)
+
+
+def pool_stats() -> dict:
+    """Connection pool usage, used to size the HTTP_* settings."""
+    if _transport is None:
+        return {"connections": 0, "idle": 0, "active": 0, "queued": 0, "hosts": {}}
+    stats = {"hosts": _transport.in_flight()}
+    # httpcore internals, which may change in any release: report what we can
+    try:
+        pool = _transport.transport._pool
+        connections = pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats |= {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+        }
+        stats["queued"] = sum(1 for request in pool._requests if request.is_queued())
+    except (AttributeError, TypeError):
+        logger.debug("Connection pool stats unavailable", exc_info=True)
+    return stats
@@ -0,0 +1,139 @@
+"""
+Leader election for the background scheduler.
+
+Every worker starts ``run_as_leader(run_scheduler)`` from its lifespan, but
+only the worker holding the lock runs the jobs. The others keep trying to
+take it over, which happens as soon as the leader exits or dies: the lock is
+a Postgres session-level advisory lock, or an ``flock`` on a file for SQLite
+and local runs, and both are released when the holder's connection or
+process goes away.
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import random
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 15.0
+ADVISORY_LOCK_KEY = zlib.crc32(b"surfcamsapi.scheduler")
+
+
+class AdvisoryLock:
+    """
+    ``pg_try_advisory_lock`` held on a dedicated connection.
+
+    The connection isn't registered with ``django.db.connections``, so
+    request handling never closes it, and all queries on it run in a single
+    thread of its own.
+    """
+
+    def __init__(self, alias="default", key=ADVISORY_LOCK_KEY):
+        self.alias = alias
+        self.key = key
+        self._connection = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="leader-lock")
+
+    async def _run(self, func):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func)
+
+    def _query(self, sql, params=None):
+        from django.db import connections
+
+        if self._connection is None:
+            self._connection = connections.create_connection(self.alias)
+        with self._connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def acquire(self) -> bool:
+        try:
+            return await self._run(
+                lambda: self._query("SELECT pg_try_advisory_lock(%s)", [self.key])
+            )
+        except Exception:
+            await self._run(self._close)
+            raise
+
+    async def check(self) -> bool:
+        """The lock is held for as long as the session that took it is alive."""
+        try:
+            await self._run(lambda: self._query("SELECT 1"))
+        except Exception:
+            logger.exception("Lost the scheduler lock connection")
+            await self._run(self._close)
+            return False
+        return True
+
+    async def release(self):
+        # Closing the session releases the lock
+        await self._run(self._close)
+
+
+class FileLock:
+    """Exclusive ``flock`` on ``path``, released by the kernel if we die."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    async def acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    async def check(self) -> bool:
+        return self._fd is not None
+
+    async def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def default_lock():
+    from django.conf import settings
+    from django.db import connection
+
+    if connection.vendor == "postgresql":
+        return AdvisoryLock()
+    return FileLock(settings.SCHEDULER_LOCK_FILE)
+
+
+async def run_as_leader(job, lock=None, poll_interval=POLL_INTERVAL_SECONDS):
+    """Run ``job()`` while this process holds ``lock``, retrying until cancelled."""
+    lock = lock if lock is not None else default_lock()
+    while True:
+        try:
+            acquired = await lock.acquire()
+        except Exception:
+            logger.exception("Acquiring the scheduler lock failed")
+            acquired = False
+        if acquired:
+            logger.info("Process %d is running the scheduler", os.getpid())
+            task = asyncio.create_task(job())
+            try:
+                while not task.done():
+                    await asyncio.wait({task}, timeout=poll_interval)
+                    if not await lock.check():
+                        logger.warning("Stopping the scheduler, lock was lost")
+                        break
+            finally:
+                task.cancel()
+                await lock.release()
+        # Spread out the followers' attempts
+        await asyncio.sleep(poll_interval * random.uniform(0.5, 1.5))
@@ -0,0 +1,310 @@
+"""
+In-process metrics served in the Prometheus text format at ``/metrics``.
+
+Counters and histograms are dicts keyed by label values behind a lock, and
+cache statistics are collected from the caches' ``stats()`` at scrape time,
+so recording a sample costs a dict update. Every worker process keeps and
+serves its own metrics.
+
+``metrics_middleware`` counts the database queries made while each view
+runs, using an execute wrapper installed on every new connection.
+
+Scrapes need an ``Authorization: Bearer <METRICS_TOKEN>`` header or a staff
+session, so ``/metrics`` is closed until a token is configured.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import sync_and_async_middleware
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+registry = []
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values: [count per bucket (plus +Inf), sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, _ = entry = self._values.setdefault(
+                label_values, [[0] * (len(self.buckets) + 1), 0.0]
+            )
+            counts[index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values) -> int:
+        entry = self._values.get(label_values)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        names = (*self.labels, "le")
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = format_labels(names, (*label_values, bound))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Collected:
+    """Samples read from ``collect()`` at scrape time, as ``{label values: value}``."""
+
+    def __init__(self, name: str, help: str, type: str, labels, collect):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = tuple(labels)
+        self.collect = collect
+        registry.append(self)
+
+    def samples(self):
+        for label_values, value in self.collect().items():
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(
+            f"{name}{labels} {value}" for name, labels, value in metric.samples()
+        )
+    return "\n".join(lines) + "\n"
+
+
+surfline_request_seconds = Histogram(
+    "surfline_request_seconds",
+    "Duration of Surfline API requests, one per attempt.",
+    ("endpoint", "outcome"),
+)
+surfline_retries = Counter(
+    "surfline_retries_total", "Surfline requests retried by stamina.", ("endpoint",)
+)
+surfline_fallbacks = Counter(
+    "surfline_fallbacks_total",
+    "Forecast endpoints that failed or missed the deadline, by whether cached "
+    "data was served instead.",
+    ("endpoint", "outcome"),
+)
+proxy_requests = Counter(
+    "proxy_requests_total", "Proxied HLS requests.", ("host", "kind")
+)
+proxy_bytes = Counter(
+    "proxy_bytes_total", "Body bytes sent for proxied HLS requests.", ("host", "kind")
+)
+scheduler_job_seconds = Histogram(
+    "scheduler_job_seconds", "Duration of scheduled job runs.", ("job",)
+)
+cams_checked = Counter(
+    "cams_checked_total", "Cams probed by the scheduler.", ("outcome",)
+)
+cam_status_changes = Counter(
+    "cam_status_changes_total", "Cams that went offline or came back online."
+)
+db_queries = Histogram(
+    "view_db_queries",
+    "Database queries made per request, by view.",
+    ("view",),
+    buckets=QUERY_BUCKETS,
+)
+
+
+def cache_stats():
+    from api.urls import cache_stats
+
+    return cache_stats()
+
+
+def surfline_breaker_stats():
+    from surfline.urls import breakers
+
+    return {name: breaker.stats() for name, breaker in breakers.items()}
+
+
+Collected(
+    "cache_hits_total",
+    "Cache hits (including stale hits) by cache.",
+    "counter",
+    ("cache",),
+    lambda: {
+        (name,): stats.get("hits", 0) + stats.get("stale_hits", 0)
+        for name, stats in cache_stats().items()
+    },
+)
+Collected(
+    "cache_misses_total",
+    "Cache misses by cache.",
+    "counter",
+    ("cache",),
+    lambda: {(name,): stats.get("misses", 0) for name, stats in cache_stats().items()},
+)
+Collected(
+    "cache_entries",
+    "Entries held by cache.",
+    "gauge",
+    ("cache",),
+    lambda: {(name,): stats.get("entries", 0) for name, stats in cache_stats().items()},
+)
+
+Collected(
+    "surfline_circuit_open",
+    "Whether the Surfline endpoint's circuit breaker is open or half-open.",
+    "gauge",
+    ("endpoint",),
+    lambda: {
+        (name,): int(stats["state"] != "closed")
+        for name, stats in surfline_breaker_stats().items()
+    },
+)
+
+
+# Query counter of the request being handled
+_request_queries: ContextVar[list[int] | None] = ContextVar(
+    "request_queries", default=None
+)
+
+
+def count_query(execute, sql, params, many, context):
+    if (queries := _request_queries.get()) is not None:
+        queries[0] += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install_on_open_connections():
+    """Cover connections that were opened before the signal was connected."""
+    for connection in connections.all(initialized_only=True):
+        install_query_counter(None, connection)
+
+
+def view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unresolved"
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    install_on_open_connections()
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            queries = [0]
+            token = _request_queries.set(queries)
+            try:
+                return await get_response(request)
+            finally:
+                _request_queries.reset(token)
+                db_queries.observe(queries[0], view_name(request))
+
+    else:
+
+        def middleware(request):
+            queries = [0]
+            token = _request_queries.set(queries)
+            try:
+                return get_response(request)
+            finally:
+                _request_queries.reset(token)
+                db_queries.observe(queries[0], view_name(request))
+
+    return middleware
+
+
+async def can_read_stats(request) -> bool:
+    """Whether the request has the metrics token or comes from a staff user."""
+    if settings.METRICS_TOKEN and constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return True
+    user = await request.auser()
+    return user.is_staff
+
+
+async def metrics_view(request):
+    if not await can_read_stats(request):
+        return HttpResponse("Unauthorized", status=401)
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,151 @@
+"""
+Shared cache for proxied HLS playlists.
+
+Every viewer of a proxied cam polls the same ``.m3u8``; the cache keeps each
+playlist for a fraction of its ``#EXT-X-TARGETDURATION`` and concurrent misses
+share one upstream fetch, so upstream load scales with cams, not viewers.
+Segment and child-playlist URIs are rewritten to go through the proxy as well.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
+
+from surfcamsapi.http import get_client
+from surfcamsapi.metrics import proxy_bytes
+from surfcamsapi.proxy import DEFAULT_CONTENT_TYPE, proxy_host, upstream_url
+
+logger = logging.getLogger(__name__)
+
+TTL_FRACTION = 0.5
+# Master playlists don't have a target duration and rarely change
+DEFAULT_TTL = 10.0
+
+TARGET_DURATION = re.compile(r"^#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)", re.MULTILINE)
+URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+
+
+@dataclass
+class Playlist:
+    status: int
+    body: bytes
+    content_type: str
+    expires_at: float
+
+
+def is_playlist(url: str) -> bool:
+    return urlsplit(url).path.endswith(".m3u8")
+
+
+def proxied_uri(uri: str, base_url: str) -> str:
+    absolute = urljoin(base_url, uri)
+    prefix = f"{settings.PROXY_UPSTREAM_SCHEME}://"
+    if not absolute.startswith(prefix):
+        return absolute
+    return reverse("proxy", kwargs={"url": absolute.removeprefix(prefix)})
+
+
+def rewrite_playlist(text: str, base_url: str) -> str:
+    lines = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            line = URI_ATTRIBUTE.sub(
+                lambda match: f'URI="{proxied_uri(match[1], base_url)}"', line
+            )
+        elif line.strip():
+            line = proxied_uri(line.strip(), base_url)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def playlist_ttl(text: str) -> float:
+    if match := TARGET_DURATION.search(text):
+        return float(match[1]) * TTL_FRACTION
+    return DEFAULT_TTL
+
+
+class PlaylistCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Playlist] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, url: str) -> Playlist:
+        playlist = self._entries.get(url)
+        if playlist is not None and time.monotonic() < playlist.expires_at:
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return playlist
+        self.misses += 1
+        task = self._inflight.get(url)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._fetch(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda t: self._done(url, t))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url: str) -> Playlist:
+        response = await get_client().get(url, headers={"Referer": settings.P_REFERER})
+        content_type = response.headers.get("Content-Type", DEFAULT_CONTENT_TYPE)
+        if response.status_code != 200:
+            return Playlist(response.status_code, response.content, content_type, 0)
+        text = response.text
+        playlist = Playlist(
+            status=200,
+            body=rewrite_playlist(text, url).encode(),
+            content_type=content_type,
+            expires_at=time.monotonic() + playlist_ttl(text),
+        )
+        self._entries[url] = playlist
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return playlist
+
+    def _done(self, url: str, task: asyncio.Task):
+        if self._inflight.get(url) is task:
+            del self._inflight[url]
+        if not task.cancelled():
+            task.exception()
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+playlist_cache = PlaylistCache()
+
+
+async def serve_playlist(request, url: str) -> HttpResponse:
+    try:
+        playlist = await playlist_cache.get(upstream_url(request, url))
+    except httpx.HTTPError as exc:
+        logger.warning("Playlist request to %s failed: %r", url, exc)
+        return HttpResponse("Bad gateway", status=502)
+    response = HttpResponse(
+        playlist.body, status=playlist.status, content_type=playlist.content_type
+    )
+    proxy_bytes.inc(proxy_host(url), "playlist", amount=len(playlist.body))
+    if playlist.status == 200:
+        max_age = max(0, int(playlist.expires_at - time.monotonic()))
+        response["Cache-Control"] = f"max-age={max_age}"
+    return response
@@ -0,0 +1,104 @@
+"""
+Streaming relay for the HLS proxy view.
+
+Upstream bytes are passed through as they arrive in chunks of
+``PROXY_CHUNK_SIZE``, so a connection never holds more than one chunk of a
+segment in memory. Conditional and range headers are forwarded so the
+upstream can answer with 206/304 directly.
+"""
+
+import logging
+
+import httpx
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+from surfcamsapi.http import get_client
+from surfcamsapi.metrics import proxy_bytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTENT_TYPE = "application/x-mpegURL"
+
+FORWARDED_REQUEST_HEADERS = (
+    "Range",
+    "If-Range",
+    "If-None-Match",
+    "If-Modified-Since",
+)
+
+FORWARDED_RESPONSE_HEADERS = (
+    "Content-Length",
+    "Content-Range",
+    "Content-Encoding",
+    "Accept-Ranges",
+    "ETag",
+    "Last-Modified",
+    "Cache-Control",
+    "Expires",
+)
+
+
+def proxy_host(url: str) -> str:
+    """Upstream host of a proxied ``<host>/<path>`` URL, the metrics label."""
+    return url.partition("/")[0]
+
+
+def upstream_url(request, url: str) -> str:
+    query = request.META.get("QUERY_STRING")
+    base = f"{settings.PROXY_UPSTREAM_SCHEME}://{url}"
+    return f"{base}?{query}" if query else base
+
+
+def upstream_headers(request) -> dict[str, str]:
+    headers = {
+        "Referer": settings.P_REFERER,
+        # The body is relayed undecoded, so only ask for encodings the
+        # client itself understands.
+        "Accept-Encoding": request.headers.get("Accept-Encoding", "identity"),
+    }
+    for name in FORWARDED_REQUEST_HEADERS:
+        if value := request.headers.get(name):
+            headers[name] = value
+    return headers
+
+
+async def relay(upstream: httpx.Response):
+    sent = 0
+    try:
+        async for chunk in upstream.aiter_raw(settings.PROXY_CHUNK_SIZE):
+            sent += len(chunk)
+            yield chunk
+    finally:
+        proxy_bytes.inc(upstream.request.url.host, "stream", amount=sent)
+        await upstream.aclose()
+
+
+async def stream_upstream(request, url: str) -> HttpResponse:
+    client = get_client()
+    try:
+        upstream = await client.send(
+            client.build_request(
+                "GET", upstream_url(request, url), headers=upstream_headers(request)
+            ),
+            stream=True,
+        )
+    except httpx.HTTPError as exc:
+        logger.warning("Proxy request to %s failed: %r", url, exc)
+        return HttpResponse("Bad gateway", status=502)
+
+    if upstream.status_code == 304:
+        await upstream.aclose()
+        response = HttpResponse(status=304)
+    else:
+        response = StreamingHttpResponse(
+            relay(upstream),
+            status=upstream.status_code,
+            content_type=upstream.headers.get("Content-Type", DEFAULT_CONTENT_TYPE),
+        )
+    for name in FORWARDED_RESPONSE_HEADERS:
+        if (value := upstream.headers.get(name)) and not (
+            response.status_code == 304 and name.startswith("Content-")
+        ):
+            response[name] = value
+    return response
@@ -1,55 +1,324 @@
 import asyncio
+import heapq
 import logging
+import math
+import random
+import time
+from dataclasses import dataclass
 
 import httpx
 
+from .metrics import cam_status_changes, cams_checked, scheduler_job_seconds
+
 logger = logging.getLogger(__name__)
 
-INTERVAL_SECONDS = 2 * 60 * 60  # 2 hours
+ONLINE_INTERVAL_SECONDS = 30 * 60  # 30 minutes
+FLAPPING_INTERVAL_SECONDS = 5 * 60  # status changed within FLAPPING_WINDOW
+FLAPPING_WINDOW_SECONDS = 60 * 60
+OFFLINE_BACKOFF_BASE_SECONDS = 5 * 60
+OFFLINE_BACKOFF_MAX_SECONDS = 24 * 60 * 60
+CAM_SYNC_INTERVAL_SECONDS = 5 * 60  # pick up cams added in the admin
+CHECK_JITTER = 0.1
+CHECK_FIELDS = ("id", "url", "proxy", "offline_since")
+CHECK_CONCURRENCY = 50  # per-host limits come from the shared client
+CHECK_TIMEOUT_SECONDS = 10.0
+CHECK_DEADLINE_SECONDS = 60.0
+PREFETCH_INTERVAL_SECONDS = 5 * 60  # 5 minutes
+PREFETCH_LEAD_SECONDS = 15 * 60  # refresh entries expiring within 15 minutes
+PREFETCH_CONCURRENCY = 4
+PREFETCH_JITTER_SECONDS = 2.0
 
 
-async def check_cams():
+async def probe_cam(client: httpx.AsyncClient, cam) -> bool:
+    """Check that the cam's stream answers, reading no more than the first chunk."""
     from django.conf import settings
 
+    try:
+        async with client.stream(
+            "GET",
+            cam.url,
+            headers={"Referer": settings.P_REFERER} if cam.proxy else {},
+            timeout=CHECK_TIMEOUT_SECONDS,
+        ) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_raw(1024):
+                break
+    except (httpx.RequestError, httpx.HTTPStatusError):
+        return False
+    return True
+
+
+async def probe_cams(cams) -> dict[int, tuple[bool, float]]:
+    """
+    Probe cams concurrently, returning ``(online, latency)`` by cam id.
+
+    Cams that haven't been probed when CHECK_DEADLINE_SECONDS runs out are
+    left out of the result.
+    """
+    from .http import get_client
+
+    client = get_client()
+    semaphore = asyncio.Semaphore(CHECK_CONCURRENCY)
+    results = {}
+
+    async def probe(cam):
+        async with semaphore:
+            start = time.monotonic()
+            online = await probe_cam(client, cam)
+            results[cam.id] = (online, time.monotonic() - start)
+            cams_checked.inc("online" if online else "offline")
+
+    try:
+        async with asyncio.timeout(CHECK_DEADLINE_SECONDS):
+            await asyncio.gather(*(probe(cam) for cam in cams))
+    except TimeoutError:
+        logger.warning("Cam check deadline hit, some cams were not checked")
+        cams_checked.inc("deadline", amount=len(cams) - len(results))
+    return results
+
+
+def update_status(cam, online: bool) -> bool:
+    """Set ``offline_since`` from a probe result, returning whether it changed."""
+    from django.utils import timezone
+
+    if online and cam.offline_since is not None:
+        cam.offline_since = None
+        return True
+    if not online and cam.offline_since is None:
+        cam.offline_since = timezone.now()
+        return True
+    return False
+
+
+def _save_status(changed):
+    from django.db import transaction
+
+    from cams import changelog
     from cams.models import Cam
 
-    cams = Cam.objects.all()
+    with transaction.atomic():
+        Cam.objects.bulk_update(changed, ["offline_since"])
+        # bulk updates don't send signals
+        changelog.record(cams=[cam.id for cam in changed])
 
-    async def check_cam_status(cam):
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    cam.url,
-                    headers={
-                        "Referer": settings.P_REFERER,
-                    }
-                    if cam.proxy
-                    else {},
-                    timeout=10.0,
-                )
-                response.raise_for_status()
-                if cam.offline_since is not None:
-                    cam.offline_since = None
-        except (httpx.RequestError, httpx.HTTPStatusError):
-            from django.utils import timezone
 
-            if cam.offline_since is None:
-                cam.offline_since = timezone.now()
-        return cam
+async def save_status(changed):
+    from asgiref.sync import sync_to_async
 
-    cam_list = [cam async for cam in cams]
-    for i in range(0, len(cam_list), 10):
-        batch = cam_list[i : i + 10]
-        await asyncio.gather(*(check_cam_status(cam) for cam in batch))
+    if changed:
+        cam_status_changes.inc(amount=len(changed))
+        await sync_to_async(_save_status)(changed)
 
-    await Cam.objects.abulk_update(cam_list, ["offline_since"])
 
+def initial_failures(offline_since) -> int:
+    """Seed the backoff of cams that were already offline before startup."""
+    if offline_since is None:
+        return 0
+    from django.utils import timezone
 
-async def run_scheduler():
-    """Run check_cams in a loop. Designed to be used as a background task."""
+    age = (timezone.now() - offline_since).total_seconds()
+    return 1 + max(0, int(math.log2(max(age, 1) / OFFLINE_BACKOFF_BASE_SECONDS)))
+
+
+@dataclass
+class CamCheckState:
+    cam_id: int
+    next_check: float = 0.0
+    failures: int = 0
+    # Failed checks outside the flapping window, each doubles the interval
+    backoff: int = 0
+    last_latency: float | None = None
+    last_change: float | None = None
+
+    def flapping(self, now: float) -> bool:
+        return (
+            self.last_change is not None
+            and now - self.last_change < FLAPPING_WINDOW_SECONDS
+        )
+
+    def interval(self, now: float) -> float:
+        if self.flapping(now):
+            return FLAPPING_INTERVAL_SECONDS
+        if self.failures:
+            return min(
+                OFFLINE_BACKOFF_BASE_SECONDS * 2 ** max(self.backoff - 1, 0),
+                OFFLINE_BACKOFF_MAX_SECONDS,
+            )
+        return ONLINE_INTERVAL_SECONDS
+
+    def record(self, online: bool, now: float):
+        if online:
+            self.failures = self.backoff = 0
+            return
+        self.failures += 1
+        if not self.flapping(now):
+            self.backoff += 1
+
+
+class CamCheckScheduler:
+    """
+    Per-cam check scheduling driven by a priority queue of due times.
+
+    Cams that recently changed status are re-checked every few minutes,
+    healthy cams every ONLINE_INTERVAL_SECONDS and offline cams back off
+    exponentially up to OFFLINE_BACKOFF_MAX_SECONDS.
+    """
+
+    def __init__(self):
+        self.states: dict[int, CamCheckState] = {}
+        self._queue: list[tuple[float, int]] = []
+        self._synced_at = float("-inf")
+
+    def schedule(self, state: CamCheckState, delay: float):
+        delay *= random.uniform(1 - CHECK_JITTER, 1 + CHECK_JITTER)
+        state.next_check = time.monotonic() + delay
+        heapq.heappush(self._queue, (state.next_check, state.cam_id))
+
+    async def sync(self):
+        """Start tracking new cams and forget deleted ones."""
+        from cams.models import Cam
+
+        cam_ids = set()
+        async for cam_id, offline_since in Cam.objects.values_list(
+            "id", "offline_since"
+        ):
+            cam_ids.add(cam_id)
+            if cam_id not in self.states:
+                failures = initial_failures(offline_since)
+                state = CamCheckState(cam_id, failures=failures, backoff=failures)
+                self.states[cam_id] = state
+                self.schedule(state, 0)
+        for cam_id in self.states.keys() - cam_ids:
+            del self.states[cam_id]
+        self._synced_at = time.monotonic()
+
+    def pop_due(self, now: float) -> list[int]:
+        cam_ids = []
+        while self._queue and self._queue[0][0] <= now:
+            next_check, cam_id = heapq.heappop(self._queue)
+            state = self.states.get(cam_id)
+            # Skip entries superseded by a later schedule() call
+            if state is not None and state.next_check == next_check:
+                cam_ids.append(cam_id)
+        return cam_ids
+
+    async def run_once(self) -> float:
+        """Check the cams that are due and return the seconds until the next one."""
+        from cams.models import Cam
+
+        if time.monotonic() - self._synced_at >= CAM_SYNC_INTERVAL_SECONDS:
+            await self.sync()
+        now = time.monotonic()
+        if cam_ids := self.pop_due(now):
+            cams = [
+                cam
+                async for cam in Cam.objects.only(*CHECK_FIELDS).filter(id__in=cam_ids)
+            ]
+            results = await probe_cams(cams)
+            changed = []
+            for cam in cams:
+                state = self.states[cam.id]
+                if cam.id not in results:
+                    self.schedule(state, FLAPPING_INTERVAL_SECONDS)
+                    continue
+                online, state.last_latency = results[cam.id]
+                if update_status(cam, online):
+                    changed.append(cam)
+                    state.last_change = now
+                state.record(online, now)
+                self.schedule(state, state.interval(now))
+            await save_status(changed)
+            logger.info(
+                "Checked %d cams, %d changed status", len(results), len(changed)
+            )
+        next_sync = self._synced_at + CAM_SYNC_INTERVAL_SECONDS
+        next_check = self._queue[0][0] if self._queue else next_sync
+        return max(0.0, min(next_check, next_sync) - time.monotonic())
+
+    async def run(self):
+        while True:
+            try:
+                with scheduler_job_seconds.time("check_cams"):
+                    delay = await self.run_once()
+            except Exception:
+                logger.exception("Scheduled cam check failed")
+                delay = FLAPPING_INTERVAL_SECONDS
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "cams": len(self.states),
+            "offline": sum(1 for state in self.states.values() if state.failures),
+            "flapping": sum(1 for state in self.states.values() if state.flapping(now)),
+            "next_check_in": max(0.0, self._queue[0][0] - now) if self._queue else None,
+        }
+
+
+cam_scheduler = CamCheckScheduler()
+
+
+async def prefetch_forecasts():
+    """Warm the forecast cache for every spot before its entries expire."""
+    from cams.models import Cam
+    from surfline.breaker import CircuitOpen
+    from surfline.cache import ENDPOINT_TTLS
+    from surfline.urls import forecast_cache
+
+    spot_ids = [
+        spot_id
+        async for spot_id in Cam.objects.exclude(spot_id__isnull=True)
+        .exclude(spot_id="")
+        .values_list("spot_id", flat=True)
+        .distinct()
+    ]
+    due = [
+        (endpoint, spot_id)
+        for spot_id in spot_ids
+        for endpoint in ENDPOINT_TTLS
+        if forecast_cache.expires_in(endpoint, spot_id) < PREFETCH_LEAD_SECONDS
+    ]
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+    async def prefetch(endpoint, spot_id):
+        # Spread the requests out so Surfline doesn't see a burst every run
+        await asyncio.sleep(random.uniform(0, PREFETCH_JITTER_SECONDS))
+        async with semaphore:
+            try:
+                await forecast_cache.refresh(endpoint, spot_id)
+            except (httpx.HTTPError, CircuitOpen) as exc:
+                logger.warning(
+                    "Prefetching %s for spot %s failed: %r", endpoint, spot_id, exc
+                )
+            except Exception:
+                # Keep prefetching the other spots, e.g. past a payload that
+                # doesn't parse
+                logger.exception("Prefetching %s for spot %s failed", endpoint, spot_id)
+
+    await asyncio.gather(*(prefetch(endpoint, spot_id) for endpoint, spot_id in due))
+    logger.info("Prefetched %d forecasts for %d spots", len(due), len(spot_ids))
+
+
+async def run_periodically(job, interval: float):
     while True:
         try:
-            await check_cams()
+            with scheduler_job_seconds.time(job.__name__):
+                await job()
         except Exception:
-            logger.exception("Scheduled check_cams failed")
-        await asyncio.sleep(INTERVAL_SECONDS)
+            logger.exception("Scheduled %s failed", job.__name__)
+        await asyncio.sleep(interval)
+
+
+async def run_scheduler():
+    """Run the cam checks in a loop. Designed to be used as a background task."""
+    await cam_scheduler.run()
+
+
+async def run_prefetcher():
+    """
+    Keep the forecast cache warm, in every worker.
+
+    The cache is per process, so unlike the cam checks this can't be left to
+    the elected worker.
+    """
+    await run_periodically(prefetch_forecasts, PREFETCH_INTERVAL_SECONDS)
@@ -0,0 +1,248 @@
+"""
+Disk-backed LRU store for proxied HLS segments.
+
+Each segment is downloaded once into ``PROXY_SEGMENT_CACHE_DIR`` and then
+served from disk to every viewer. With ``PROXY_SEGMENT_ACCEL_REDIRECT`` set,
+nginx serves the file itself (using sendfile) via ``X-Accel-Redirect``;
+otherwise the file is streamed in chunks. File IO runs in threads, off the
+event loop.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+from surfcamsapi.http import get_client
+from surfcamsapi.metrics import proxy_bytes
+from surfcamsapi.proxy import proxy_host, stream_upstream, upstream_url
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_CONTENT_TYPES = {
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".aac": "audio/aac",
+    ".m4a": "audio/mp4",
+    ".vtt": "text/vtt",
+}
+
+SWEEP_INTERVAL_SECONDS = 10
+
+
+class SegmentUnavailable(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"Upstream answered {status}")
+        self.status = status
+
+
+@dataclass
+class Segment:
+    key: str
+    path: Path
+    size: int
+    stored_at: float
+
+
+def segment_extension(url: str) -> str:
+    return os.path.splitext(urlsplit(url).path)[1].lower()
+
+
+def is_segment(url: str) -> bool:
+    return settings.PROXY_SEGMENT_CACHE_MAX_BYTES > 0 and (
+        segment_extension(url) in SEGMENT_CONTENT_TYPES
+    )
+
+
+class SegmentStore:
+    def __init__(self, directory: Path, max_bytes: int, max_age: float):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._index: OrderedDict[str, Segment] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._loaded = False
+        self._last_sweep = 0.0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.bytes_fetched = 0
+
+    def _scan(self) -> list[Segment]:
+        """Segments left on disk by a previous run or another worker."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        now = time.time()
+        for path in self.directory.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.name.endswith(".tmp"):
+                # Downloads interrupted by a crash; other workers' are fresh
+                if now - stat.st_mtime > self.max_age:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append(Segment(path.name, path, stat.st_size, stat.st_mtime))
+        return entries
+
+    async def _load(self):
+        entries = await asyncio.to_thread(self._scan)
+        # Another request may have loaded them while we were scanning
+        if not self._loaded:
+            for segment in sorted(entries, key=lambda segment: segment.stored_at):
+                self._add(segment)
+            self._loaded = True
+
+    def _add(self, segment: Segment):
+        if old := self._index.pop(segment.key, None):
+            self.size -= old.size
+        self._index[segment.key] = segment
+        self.size += segment.size
+
+    def _remove(self, key: str) -> Path | None:
+        """Drop a segment from the index, returning the file to delete."""
+        if segment := self._index.pop(key, None):
+            self.size -= segment.size
+            return segment.path
+        return None
+
+    def _evict(self) -> list[Path]:
+        now = time.time()
+        removed = []
+        if now - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+            self._last_sweep = now
+            removed += [
+                self._remove(key)
+                for key in [
+                    key
+                    for key, segment in self._index.items()
+                    if now - segment.stored_at > self.max_age
+                ]
+            ]
+        while self.size > self.max_bytes and self._index:
+            removed.append(self._remove(next(iter(self._index))))
+        return removed
+
+    @staticmethod
+    def _delete(paths: list[Path]):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    async def get(self, url: str) -> Segment:
+        if not self._loaded:
+            await self._load()
+        key = hashlib.sha256(url.encode()).hexdigest()
+        segment = self._index.get(key)
+        if segment is not None:
+            if time.time() - segment.stored_at <= self.max_age:
+                self._index.move_to_end(key)
+                self.hits += 1
+                self.bytes_served += segment.size
+                return segment
+            await asyncio.to_thread(self._delete, [self._remove(key)])
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._download(key, url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        segment = await asyncio.shield(task)
+        self.bytes_served += segment.size
+        return segment
+
+    async def _download(self, key: str, url: str) -> Segment:
+        path = self.directory / key
+        tmp_path = self.directory / f"{key}.{os.getpid()}.tmp"
+        size = 0
+        try:
+            async with get_client().stream(
+                "GET", url, headers={"Referer": settings.P_REFERER}
+            ) as response:
+                if response.status_code != 200:
+                    raise SegmentUnavailable(response.status_code)
+                f = await asyncio.to_thread(tmp_path.open, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(settings.PROXY_CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        finally:
+            await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+        self.bytes_fetched += size
+        segment = Segment(key, path, size, time.time())
+        self._add(segment)
+        await asyncio.to_thread(self._delete, self._evict())
+        return segment
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._index),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_served": self.bytes_served,
+            "bytes_fetched": self.bytes_fetched,
+        }
+
+
+segment_store = SegmentStore(
+    settings.PROXY_SEGMENT_CACHE_DIR,
+    max_bytes=settings.PROXY_SEGMENT_CACHE_MAX_BYTES,
+    max_age=settings.PROXY_SEGMENT_CACHE_MAX_AGE,
+)
+
+
+async def read_chunks(f):
+    """Read ``f`` in chunks in a thread, closing it once done."""
+    try:
+        while chunk := await asyncio.to_thread(f.read, settings.PROXY_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def serve_segment(request, url: str) -> HttpResponse:
+    try:
+        segment = await segment_store.get(upstream_url(request, url))
+    except SegmentUnavailable as exc:
+        return HttpResponse(status=exc.status)
+    except httpx.HTTPError as exc:
+        logger.warning("Segment request to %s failed: %r", url, exc)
+        return HttpResponse("Bad gateway", status=502)
+
+    content_type = SEGMENT_CONTENT_TYPES[segment_extension(url)]
+    if prefix := settings.PROXY_SEGMENT_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = prefix + segment.key
+    else:
+        try:
+            f = await asyncio.to_thread(segment.path.open, "rb")
+        except FileNotFoundError:
+            # Evicted in the meantime, possibly by another worker
+            return await stream_upstream(request, url)
+        # An async iterator, so that ASGI doesn't read the whole file at once
+        response = StreamingHttpResponse(read_chunks(f), content_type=content_type)
+        response["Content-Length"] = segment.size
+    proxy_bytes.inc(proxy_host(url), "segment", amount=segment.size)
+    response["Cache-Control"] = f"max-age={int(segment_store.max_age)}"
+    return response
@@ -66,6 +66,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "surfcamsapi.compression.compression_middleware",
+    "surfcamsapi.metrics.metrics_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -159,6 +161,72 @@ STATICFILES_DIRS = [
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 P_REFERER = env("P_REFERER", default="")
+# Scheme of the proxied upstream URLs, "http" is only for local stubs
+PROXY_UPSTREAM_SCHEME = env("PROXY_UPSTREAM_SCHEME", default="https")
+
+PROXY_CHUNK_SIZE = env.int("PROXY_CHUNK_SIZE", default=64 * 1024)
+
+# On-disk cache for proxied HLS segments, set the size to 0 to disable it.
+# PROXY_SEGMENT_ACCEL_REDIRECT is the internal nginx location aliased to the
+# cache directory, e.g. "/_segments/", so nginx can serve files with sendfile.
+# Every worker enforces the size limit on its own downloads, so the directory
+# can grow to PROXY_SEGMENT_CACHE_MAX_BYTES times the number of workers.
+PROXY_SEGMENT_CACHE_DIR = env.path(
+    "PROXY_SEGMENT_CACHE_DIR", default=BASE_DIR / "segment_cache"
+)
+PROXY_SEGMENT_CACHE_MAX_BYTES = env.int(
+    "PROXY_SEGMENT_CACHE_MAX_BYTES", default=512 * 1024 * 1024
+)
+PROXY_SEGMENT_CACHE_MAX_AGE = env.float("PROXY_SEGMENT_CACHE_MAX_AGE", default=300.0)
+PROXY_SEGMENT_ACCEL_REDIRECT = env("PROXY_SEGMENT_ACCEL_REDIRECT", default="")
+
+# Shared outgoing HTTP client (see surfcamsapi/http.py)
+# HTTP2 requires the optional `h2` package (httpx[http2]).
+
+HTTP_MAX_CONNECTIONS = env.int("HTTP_MAX_CONNECTIONS", default=100)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = env.int("HTTP_MAX_KEEPALIVE_CONNECTIONS", default=20)
+HTTP_MAX_CONNECTIONS_PER_HOST = env.int("HTTP_MAX_CONNECTIONS_PER_HOST", default=10)
+HTTP_KEEPALIVE_EXPIRY = env.float("HTTP_KEEPALIVE_EXPIRY", default=30.0)
+HTTP2 = env.bool("HTTP2", default=False)
+HTTP_CONNECT_TIMEOUT = env.float("HTTP_CONNECT_TIMEOUT", default=5.0)
+HTTP_READ_TIMEOUT = env.float("HTTP_READ_TIMEOUT", default=10.0)
+HTTP_POOL_TIMEOUT = env.float("HTTP_POOL_TIMEOUT", default=5.0)
+
+# orjson renderer and unvalidated catalog serialization for the API
+API_FAST_JSON = env.bool("API_FAST_JSON", default=False)
+
+SURFLINE_BASE_URL = env(
+    "SURFLINE_BASE_URL", default="https://services.surfline.com/kbyg/spots/forecasts/"
+)
+# A forecast waits at most SURFLINE_DEADLINE_SECONDS for all endpoints before
+# falling back to cached data. An endpoint's circuit opens after
+# SURFLINE_BREAKER_FAILURES consecutive failures and is probed again after
+# SURFLINE_BREAKER_RESET_SECONDS.
+SURFLINE_DEADLINE_SECONDS = env.float("SURFLINE_DEADLINE_SECONDS", default=3.0)
+SURFLINE_BREAKER_FAILURES = env.int("SURFLINE_BREAKER_FAILURES", default=5)
+SURFLINE_BREAKER_RESET_SECONDS = env.float(
+    "SURFLINE_BREAKER_RESET_SECONDS", default=30.0
+)
+FORECAST_CACHE_MAX_ENTRIES = env.int("FORECAST_CACHE_MAX_ENTRIES", default=2048)
+
+# Directory for the catalog snapshot shared by all workers (see cams/snapshots.py).
+# Set it when running more than one worker, otherwise catalog changes only
+# reach the worker that made them.
+CATALOG_SNAPSHOT_DIR = env("CATALOG_SNAPSHOT_DIR", default="")
+CATALOG_SNAPSHOT_POLL_SECONDS = env.float("CATALOG_SNAPSHOT_POLL_SECONDS", default=2.0)
+# Catalog changes kept for /api/cams.json?since=<version>, older cursors get
+# a full snapshot instead of a delta
+CATALOG_CHANGELOG_SIZE = env.int("CATALOG_CHANGELOG_SIZE", default=10000)
+
+# Bearer token required to scrape /metrics. Without one only staff users can
+# read it.
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+
+# Only one worker runs the scheduler, elected with a Postgres advisory lock or,
+# on other databases, an flock on this file (see surfcamsapi/leader.py).
+SCHEDULER_LOCK_FILE = env.path(
+    "SCHEDULER_LOCK_FILE", default=BASE_DIR / "scheduler.lock"
+)
 
 DEFAULT_NEXT_PAGE = "/"
 
@@ -0,0 +1,539 @@
+import asyncio
+import gzip
+import io
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import httpx
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from cams import catalog
+from cams.management.commands.import_json import iter_categories
+from cams.models import Cam, Category, CategoryCam
+from surfcamsapi import http
+from surfcamsapi.compression import body_cache
+from surfcamsapi.leader import FileLock, run_as_leader
+from surfcamsapi.metrics import proxy_bytes, proxy_requests
+from surfcamsapi.playlists import playlist_cache, rewrite_playlist
+from surfcamsapi.scheduler import (
+    FLAPPING_INTERVAL_SECONDS,
+    OFFLINE_BACKOFF_BASE_SECONDS,
+    ONLINE_INTERVAL_SECONDS,
+    CamCheckScheduler,
+    CamCheckState,
+    prefetch_forecasts,
+)
+from surfcamsapi.segments import SegmentStore
+from surfline.cache import ForecastCache
+
+
+def mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class TestProxy(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("surfer")
+
+    def setUp(self):
+        playlist_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.segment_store = SegmentStore(Path(directory.name), 1024, 60)
+        patcher = mock.patch("surfcamsapi.segments.segment_store", self.segment_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def get(self, path, handler, **headers):
+        await self.async_client.aforce_login(self.user)
+        client = mock_client(handler)
+        with (
+            mock.patch("surfcamsapi.proxy.get_client", lambda: client),
+            mock.patch("surfcamsapi.playlists.get_client", lambda: client),
+            mock.patch("surfcamsapi.segments.get_client", lambda: client),
+        ):
+            response = await self.async_client.get(path, headers=headers)
+            if response.streaming and response.is_async:
+                response.body = b"".join([c async for c in response.streaming_content])
+            elif response.streaming:
+                response.body = b"".join(response.streaming_content)
+        return response
+
+    async def test_streams_upstream_body(self):
+        def handler(request):
+            self.assertEqual(str(request.url), "https://cdn.example.com/a.jpg?t=1")
+            return httpx.Response(
+                200,
+                stream=httpx.ByteStream(b"x" * 100_000),
+                headers={"Content-Type": "image/jpeg", "Content-Length": "100000"},
+            )
+
+        response = await self.get("/p/cdn.example.com/a.jpg?t=1", handler)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Content-Length"], "100000")
+        self.assertEqual(response.body, b"x" * 100_000)
+
+    async def test_forwards_range(self):
+        def handler(request):
+            self.assertEqual(request.headers["Range"], "bytes=0-1")
+            return httpx.Response(
+                206,
+                stream=httpx.ByteStream(b"ab"),
+                headers={"Content-Range": "bytes 0-1/10"},
+            )
+
+        response = await self.get(
+            "/p/cdn.example.com/a.ts",
+            handler,
+            Range="bytes=0-1",
+            Accept_Encoding="gzip",
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 0-1/10")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.body, b"ab")
+
+    async def test_not_modified(self):
+        def handler(request):
+            self.assertEqual(request.headers["If-None-Match"], '"v1"')
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+
+        response = await self.get(
+            "/p/cdn.example.com/a.ts", handler, If_None_Match='"v1"'
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], '"v1"')
+
+    async def test_playlist_is_cached_and_coalesced(self):
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, text="#EXTM3U\n#EXT-X-TARGETDURATION:6\na.ts\n")
+
+        responses = await asyncio.gather(
+            *(self.get("/p/cdn.example.com/live/index.m3u8", handler) for _ in range(3))
+        )
+        responses.append(await self.get("/p/cdn.example.com/live/index.m3u8", handler))
+        self.assertEqual(len(calls), 1)
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"/p/cdn.example.com/live/a.ts", response.content)
+
+    async def test_segment_is_downloaded_once(self):
+        requests = proxy_requests.value("cdn.example.com", "segment")
+        sent = proxy_bytes.value("cdn.example.com", "segment")
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, stream=httpx.ByteStream(b"segment"))
+
+        for _ in range(2):
+            response = await self.get(
+                "/p/cdn.example.com/live/1.ts", handler, Accept_Encoding="gzip"
+            )
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "video/mp2t")
+            self.assertEqual(response["Content-Length"], "7")
+            self.assertTrue(response.is_async)
+            self.assertEqual(response.body, b"segment")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.segment_store.stats()["hits"], 1)
+        self.assertEqual(
+            proxy_requests.value("cdn.example.com", "segment"), requests + 2
+        )
+        self.assertEqual(proxy_bytes.value("cdn.example.com", "segment"), sent + 14)
+
+    async def test_segment_cache_is_bounded(self):
+        def handler(request):
+            return httpx.Response(200, stream=httpx.ByteStream(b"x" * 600))
+
+        await self.get("/p/cdn.example.com/live/1.ts", handler)
+        await self.get("/p/cdn.example.com/live/2.ts", handler)
+        stats = self.segment_store.stats()
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["bytes"], 600)
+
+
+class TestCamsPage(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+        self.client.force_login(User.objects.create_user("surfer"))
+
+    def test_not_modified(self):
+        Category.objects.create(title="Slovenia", color="#00ff00")
+        response = self.client.get("/")
+        self.assertContains(response, "Slovenia")
+        response = self.client.get("/", headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_page_uses_the_catalog_index(self):
+        category = Category.objects.create(title="Slovenia", color="#00ff00")
+        cams = [
+            Cam.objects.create(slug=f"cam-{i}", url="https://cam.test/", title=f"C{i}")
+            for i in range(3)
+        ]
+        for order, cam in enumerate(cams):
+            CategoryCam.objects.create(category=category, cam=cam, order=order)
+        self.client.get("/cams/cam-0/")
+        # Only the session and the user are loaded
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/cams/{cams[1].id}/")
+        self.assertEqual(list(response.context["related_cams"]), cams)
+        self.assertEqual(self.client.get("/cams/missing/").status_code, 404)
+
+    def test_dynamic_pages_are_compressed_once(self):
+        cam = Cam.objects.create(slug="cam", url="https://cam.test/", title="Cam")
+        plain = self.client.get(f"/api/cams/{cam.id}")
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        hits = body_cache.hits
+        for _ in range(2):
+            response = self.client.get(
+                f"/api/cams/{cam.id}", headers={"Accept-Encoding": "gzip"}
+            )
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(body_cache.hits, hits + 1)
+
+    def test_private_pages_are_not_cached(self):
+        misses = body_cache.misses
+        response = self.client.get(
+            "/accounts/login/", headers={"Accept-Encoding": "br, gzip"}
+        )
+        self.assertIn("Cookie", response["Vary"])
+        # Only gzip, which gets the BREACH padding
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b"csrfmiddlewaretoken", gzip.decompress(response.content))
+        self.assertEqual(body_cache.misses, misses)
+
+    def test_metrics(self):
+        self.client.get("/")
+        # Closed by default
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.client.force_login(User.objects.create_user("admin", is_staff=True))
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "# TYPE view_db_queries histogram")
+        self.assertContains(response, 'view_db_queries_count{view="cams"}')
+        self.assertContains(response, 'cache_hits_total{cache="compression"}')
+
+        self.client.logout()
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get(
+                "/metrics", headers={"Authorization": "Bearer secret"}
+            )
+            self.assertEqual(response.status_code, 200)
+
+
+class TestCamCheckScheduler(TestCase):
+    async def test_only_changed_cams_are_written(self):
+        now = timezone.now()
+        back = await Cam.objects.acreate(
+            slug="back", url="https://up.example.com/", offline_since=now
+        )
+        down = await Cam.objects.acreate(slug="down", url="https://down.example.com/")
+        still_down = await Cam.objects.acreate(
+            slug="still-down", url="https://down.example.com/2", offline_since=now
+        )
+
+        def handler(request):
+            if request.url.host == "down.example.com":
+                return httpx.Response(404)
+            return httpx.Response(200, stream=httpx.ByteStream(b"#EXTM3U"))
+
+        client = mock_client(handler)
+        with (
+            mock.patch("surfcamsapi.http.get_client", lambda: client),
+            mock.patch.object(
+                Cam.objects, "bulk_update", wraps=Cam.objects.bulk_update
+            ) as bulk_update,
+        ):
+            await CamCheckScheduler().run_once()
+
+        # still_down didn't change, so it isn't part of the UPDATE
+        bulk_update.assert_called_once()
+        changed, fields = bulk_update.call_args.args
+        self.assertCountEqual([cam.id for cam in changed], [back.id, down.id])
+        self.assertEqual(fields, ["offline_since"])
+        await back.arefresh_from_db()
+        await down.arefresh_from_db()
+        await still_down.arefresh_from_db()
+        self.assertIsNone(back.offline_since)
+        self.assertIsNotNone(down.offline_since)
+        self.assertEqual(still_down.offline_since, now)
+
+    async def test_scheduler_backs_off_offline_cams(self):
+        down = await Cam.objects.acreate(slug="down", url="https://down.example.com/")
+        up = await Cam.objects.acreate(slug="up", url="https://up.example.com/")
+        client = mock_client(
+            lambda request: (
+                httpx.Response(404)
+                if request.url.host == "down.example.com"
+                else httpx.Response(200, stream=httpx.ByteStream(b"#EXTM3U"))
+            )
+        )
+        scheduler = CamCheckScheduler()
+        with mock.patch("surfcamsapi.http.get_client", lambda: client):
+            await scheduler.run_once()
+
+        await down.arefresh_from_db()
+        self.assertIsNotNone(down.offline_since)
+        self.assertEqual(scheduler.states[down.id].failures, 1)
+        self.assertEqual(scheduler.states[up.id].failures, 0)
+        # Only the cam that just went down is re-checked soon
+        self.assertEqual(scheduler.stats()["flapping"], 1)
+        self.assertEqual(
+            scheduler.pop_due(scheduler.states[down.id].next_check), [down.id]
+        )
+
+
+def cam_json(title, url):
+    return {
+        "title": title,
+        "subTitle": "",
+        "url": url,
+        "titleColor": "#000000",
+        "subTitleColor": "#000000",
+        "backgroundColor": "#ffffff",
+    }
+
+
+class TestPrefetchForecasts(TestCase):
+    async def test_due_entries_are_refreshed(self):
+        await Cam.objects.acreate(slug="a", url="https://a.example.com/", spot_id="a")
+        await Cam.objects.acreate(slug="b", url="https://b.example.com/", spot_id="")
+        fetched = []
+
+        async def fetch(endpoint, spot_id):
+            fetched.append((endpoint, spot_id))
+            if endpoint == "tides":
+                raise httpx.ConnectError("down")
+            return endpoint
+
+        cache = ForecastCache(fetch)
+        await cache.get("wind", "a")
+        fetched.clear()
+        with (
+            mock.patch("surfline.urls.forecast_cache", cache),
+            mock.patch("surfcamsapi.scheduler.PREFETCH_JITTER_SECONDS", 0),
+        ):
+            await prefetch_forecasts()
+
+        # The fresh wind entry is skipped, the failed tides don't stop the rest
+        self.assertCountEqual(
+            fetched, [("tides", "a"), ("sunlight", "a"), ("waves", "a")]
+        )
+        self.assertGreater(cache.expires_in("waves", "a"), 0)
+        self.assertEqual(cache.expires_in("tides", "a"), float("-inf"))
+
+
+class TestImportJson(TestCase):
+    def import_json(self, categories, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump({"categories": categories}, f)
+            f.flush()
+            call_command("import_json", f.name, "--upsert", *args, stdout=io.StringIO())
+
+    def test_upsert_keeps_cam_state(self):
+        a = cam_json("A", "https://a.example.com/")
+        b = cam_json("B", "https://b.example.com/")
+        self.import_json([{"title": "North", "color": "#ff0000", "cams": [a, b]}])
+        cam = Cam.objects.get(url=a["url"])
+        cam.spot_id = "spot"
+        cam.offline_since = timezone.now()
+        cam.save()
+
+        renamed = {**a, "title": "A renamed"}
+        self.import_json(
+            [
+                {"title": "North", "color": "#ff0000", "cams": [b, renamed]},
+                {"title": "South", "color": "#0000ff", "cams": [renamed]},
+            ]
+        )
+
+        updated = Cam.objects.get(pk=cam.pk)
+        self.assertEqual(updated.title, "A renamed")
+        self.assertEqual((updated.slug, updated.spot_id), (cam.slug, "spot"))
+        self.assertIsNotNone(updated.offline_since)
+        self.assertEqual(
+            list(
+                CategoryCam.objects.filter(category__title="North")
+                .order_by("order")
+                .values_list("cam__title", flat=True)
+            ),
+            ["B", "A renamed"],
+        )
+        self.assertEqual(Cam.objects.count(), 2)
+
+        self.import_json(
+            [{"title": "South", "color": "#0000ff", "cams": [renamed]}], "--prune"
+        )
+        self.assertEqual(
+            list(Category.objects.values_list("title", flat=True)), ["South"]
+        )
+        self.assertEqual(list(Cam.objects.values_list("pk", flat=True)), [cam.pk])
+
+    def test_iter_categories_across_chunks(self):
+        categories = [
+            {"title": f"Category {i}", "color": "#000000", "cams": []} for i in range(5)
+        ]
+        document = json.dumps(
+            {
+                "version": 123456789,
+                "meta": {"categories": ["not these"]},
+                "categories": categories,
+            },
+            indent=2,
+        )
+        self.assertEqual(
+            list(iter_categories(io.StringIO(document), chunk_size=7)), categories
+        )
+
+        # Invalid files fail without being read to the end
+        f = io.StringIO('{"categories": [{"title": nope}' + " " * 100_000 + "]}")
+        with self.assertRaisesMessage(CommandError, "Invalid JSON file"):
+            list(iter_categories(f, chunk_size=64))
+        self.assertLess(f.tell(), 1000)
+
+
+class TestHttpClient(SimpleTestCase):
+    def test_client_of_another_loop_is_closed(self):
+        async def current():
+            return http.get_client()
+
+        old = asyncio.run(current())
+        self.addCleanup(asyncio.run, http.close_client())
+
+        async def replace():
+            client = http.get_client()
+            await asyncio.gather(*http._closing)
+            return client
+
+        self.assertIsNot(asyncio.run(replace()), old)
+        self.assertTrue(old.is_closed)
+
+    async def test_in_flight_per_host(self):
+        transport = http.HostLimitedTransport(
+            httpx.MockTransport(
+                lambda request: httpx.Response(200, stream=httpx.ByteStream(b"x"))
+            ),
+            max_per_host=2,
+        )
+        async with (
+            httpx.AsyncClient(transport=transport) as client,
+            client.stream("GET", "https://cdn.example.com/a"),
+        ):
+            self.assertEqual(transport.in_flight(), {"cdn.example.com": 1})
+        self.assertEqual(transport.in_flight(), {})
+
+    async def test_waiting_for_a_host_slot_times_out(self):
+        transport = http.HostLimitedTransport(
+            httpx.MockTransport(
+                lambda request: httpx.Response(200, stream=httpx.ByteStream(b"x"))
+            ),
+            max_per_host=1,
+        )
+        async with (
+            httpx.AsyncClient(
+                transport=transport, timeout=httpx.Timeout(1, pool=0.01)
+            ) as client,
+            client.stream("GET", "https://cdn.example.com/a"),
+        ):
+            with self.assertRaises(httpx.PoolTimeout):
+                await client.get("https://cdn.example.com/b")
+            self.assertEqual(transport.in_flight(), {"cdn.example.com": 1})
+
+
+class TestLeaderElection(SimpleTestCase):
+    async def test_only_one_process_runs_the_job(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "scheduler.lock"
+        runs = []
+
+        async def job():
+            runs.append(1)
+            await asyncio.Event().wait()
+
+        leader = asyncio.create_task(run_as_leader(job, FileLock(path), 0.01))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(run_as_leader(job, FileLock(path), 0.01))
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(runs), 1)
+
+        # The follower takes over once the leader is gone
+        leader.cancel()
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(runs), 2)
+        follower.cancel()
+        await asyncio.gather(leader, follower, return_exceptions=True)
+
+
+class TestCamCheckState(SimpleTestCase):
+    def test_interval(self):
+        self.assertEqual(CamCheckState(1).interval(0), ONLINE_INTERVAL_SECONDS)
+        self.assertEqual(
+            CamCheckState(1, failures=3, backoff=3).interval(0),
+            4 * OFFLINE_BACKOFF_BASE_SECONDS,
+        )
+        self.assertEqual(
+            CamCheckState(1, failures=50, backoff=50).interval(0), 24 * 60 * 60
+        )
+        flapping = CamCheckState(1, failures=3, last_change=100)
+        self.assertEqual(flapping.interval(200), FLAPPING_INTERVAL_SECONDS)
+
+    def test_offline_schedule(self):
+        # Went offline at 0 and stays offline for two days
+        state = CamCheckState(1, last_change=0)
+        now = 0
+        intervals = []
+        while now < 2 * 24 * 60 * 60:
+            state.record(False, now)
+            intervals.append(state.interval(now))
+            now += intervals[-1]
+        minutes = [interval // 60 for interval in intervals]
+        # Every 5 minutes during the flapping hour, then doubling from the base
+        self.assertEqual(minutes[:12], [5] * 12)
+        self.assertEqual(minutes[12:21], [5, 10, 20, 40, 80, 160, 320, 640, 1280])
+        self.assertEqual(set(minutes[21:]), {24 * 60})
+
+        # Back online: checked often again right away
+        state.record(True, now)
+        state.last_change = now
+        self.assertEqual(state.interval(now), FLAPPING_INTERVAL_SECONDS)
+        self.assertEqual(state.interval(now + 60 * 60), ONLINE_INTERVAL_SECONDS)
+
+
+class TestRewritePlaylist(SimpleTestCase):
+    def test_rewrites_segment_and_attribute_uris(self):
+        playlist = """#EXTM3U
+#EXT-X-MAP:URI="init.mp4"
+#EXTINF:6.0,
+seg1.m4s?token=1
+#EXTINF:6.0,
+https://other.example.com/seg2.m4s"""
+        rewritten = rewrite_playlist(
+            playlist, "https://cdn.example.com/live/index.m3u8"
+        )
+        self.assertEqual(
+            rewritten.splitlines(),
+            [
+                "#EXTM3U",
+                '#EXT-X-MAP:URI="/p/cdn.example.com/live/init.mp4"',
+                "#EXTINF:6.0,",
+                "/p/cdn.example.com/live/seg1.m4s%3Ftoken=1",
+                "#EXTINF:6.0,",
+                "/p/other.example.com/seg2.m4s",
+            ],
+        )
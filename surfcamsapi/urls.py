@@ -15,68 +15,69 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
-import httpx
-from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth import alogin, authenticate
 from django.contrib.auth.decorators import login_required
-from django.db.models import Prefetch
 from django.http import HttpResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.urls import include, path
 
 from api.urls import api
-from cams.models import Cam, Category
-from surfline.urls import get_surfline_data
+from cams import catalog
+from cams.index import aget_index, get_index
+from surfcamsapi.compression import CompressedPayload
+from surfcamsapi.metrics import metrics_view, proxy_requests
+from surfcamsapi.playlists import is_playlist, serve_playlist
+from surfcamsapi.proxy import FORWARDED_REQUEST_HEADERS, proxy_host, stream_upstream
+from surfcamsapi.segments import is_segment, serve_segment
+from surfline.urls import get_surfline_data, get_surfline_section
 
 
 @login_required
 async def get_full_detail(request, cam_id: str):
-    try:
-        cam = await Cam.objects.aget(slug=cam_id)
-    except Cam.DoesNotExist:
-        if cam_id.isdigit():
-            try:
-                cam = await Cam.objects.aget(id=cam_id)
-            except Cam.DoesNotExist:
-                return HttpResponse("Cam not found", status=404)
-        else:
-            return HttpResponse("Cam not found", status=404)
-    related_cams = await cam.related_cams()
+    index = await aget_index()
+    if (cam := index.get_cam(cam_id)) is None:
+        return HttpResponse("Cam not found", status=404)
 
     return render(
         request,
         "fulldetail.html",
         {
             "cam": cam,
-            "related_cams": related_cams,
+            "related_cams": index.related_cams(cam),
         },
     )
 
 
+def build_cams_page() -> CompressedPayload:
+    body = render_to_string("cams.html", {"categories": get_index().categories})
+    return CompressedPayload(
+        body.encode(),
+        content_type="text/html; charset=utf-8",
+        last_modified=catalog.last_modified(),
+    )
+
+
 @login_required
 async def cams(request):
-    categories = [
-        cat
-        async for cat in Category.objects.all()
-        .prefetch_related(
-            Prefetch("cam_set", queryset=Cam.objects.order_by("categorycam__order"))
-        )
-        .order_by("order")
-    ]
-    return render(request, "cams.html", {"categories": list(categories)})
+    # The page is the same for every logged in user
+    page = await catalog.aget_cached("cams.html", build_cams_page)
+    return page.response(request, cache_control="private, no-cache")
 
 
 @login_required
 async def proxy(request, url: str):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"https://{url}",
-            headers={
-                "Referer": settings.P_REFERER,
-            },
-        )
-        return HttpResponse(response.content, content_type="application/x-mpegURL")
+    host = proxy_host(url)
+    if not any(name in request.headers for name in FORWARDED_REQUEST_HEADERS):
+        if is_playlist(url):
+            proxy_requests.inc(host, "playlist")
+            return await serve_playlist(request, url)
+        if is_segment(url):
+            proxy_requests.inc(host, "segment")
+            return await serve_segment(request, url)
+    proxy_requests.inc(host, "stream")
+    return await stream_upstream(request, url)
 
 
 async def login_view(request):
@@ -98,9 +99,15 @@ urlpatterns = [
     path("accounts/", include("django.contrib.auth.urls")),
     path("cams/<str:cam_id>/", get_full_detail, name="cam_full_detail"),
     path("surfline/<int:cam_id>/", get_surfline_data, name="surfline_detail"),
+    path(
+        "surfline/<int:cam_id>/<slug:section>/",
+        get_surfline_section,
+        name="surfline_section",
+    ),
     path("admin/", admin.site.urls),
     path("api/index", cams),  # TODO: remove soon
     path("api/cams/<int:cam_id>/full", get_full_detail),  # TODO: remove soon
     path("api/", api.urls),
     path("p/<path:url>", proxy, name="proxy"),
+    path("metrics", metrics_view, name="metrics"),
 ]
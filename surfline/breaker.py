@@ -0,0 +1,74 @@
+"""
+Per-endpoint circuit breakers for Surfline requests.
+
+After ``failure_threshold`` consecutive failures a breaker opens and calls
+fail fast with ``CircuitOpen`` instead of waiting on a degraded upstream.
+Once ``reset_timeout`` has passed it's half-open: a single probe call goes
+through and closes the breaker if it succeeds, or opens it again if it fails.
+"""
+
+import time
+from contextlib import contextmanager
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit for {name} is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.rejected = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    @contextmanager
+    def guard(self):
+        """Run the block as a call through the breaker."""
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpen(self.name)
+        # Only the probe itself may end the probe, not a call that was let
+        # through while closed and finishes after the breaker opened
+        probe = state == HALF_OPEN
+        if probe:
+            self._probing = True
+        try:
+            yield
+        except Exception:
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            raise
+        else:
+            self.failures = 0
+            self.opened_at = None
+        finally:
+            # Also when cancelled, so that the next call can probe
+            if probe:
+                self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
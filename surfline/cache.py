@@ -0,0 +1,179 @@
+"""
+In-process cache for Surfline forecast data keyed by endpoint and spot_id.
+
+Concurrent misses for the same key share a single upstream call, expired
+entries are served stale while a background refresh runs, and the least
+recently used entries are evicted once ``max_entries`` is reached.
+
+``FragmentCache`` keeps the rendered forecast fragment per spot for as long
+as the spot's forecast validator doesn't change.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import UTC, datetime
+
+logger = logging.getLogger(__name__)
+
+HOUR = 60 * 60
+
+ENDPOINT_TTLS = {
+    "tides": 24 * HOUR,
+    "sunlight": 24 * HOUR,
+    "wind": HOUR,
+    "waves": HOUR,
+}
+
+# Tides and sunlight are converted to minutes relative to today's midnight,
+# so they must not be reused across days.
+DATED_ENDPOINTS = frozenset({"tides", "sunlight"})
+
+
+@dataclass
+class CacheEntry:
+    value: object
+    fetched_at: float
+    expires_at: float
+    stale_until: float
+
+
+class ForecastCache:
+    def __init__(self, fetch, ttls=ENDPOINT_TTLS, max_entries=2048, stale_factor=1.0):
+        self.fetch = fetch
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.stale_factor = stale_factor
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def key(self, endpoint: str, spot_id: str) -> tuple:
+        if endpoint in DATED_ENDPOINTS:
+            return (endpoint, spot_id, datetime.now(UTC).date())
+        return (endpoint, spot_id)
+
+    def entry(self, endpoint: str, spot_id: str) -> CacheEntry | None:
+        return self._entries.get(self.key(endpoint, spot_id))
+
+    def expires_in(self, endpoint: str, spot_id: str) -> float:
+        """Seconds until the entry expires, negative or -inf when it's due."""
+        entry = self.entry(endpoint, spot_id)
+        if entry is None:
+            return float("-inf")
+        return entry.expires_at - time.monotonic()
+
+    def validator(self, spot_id: str, endpoints=None) -> tuple[str, float | None]:
+        """ETag and Last-Modified for the spot's cached ``endpoints`` (or all)."""
+        fetched = [
+            entry.fetched_at if (entry := self.entry(endpoint, spot_id)) else 0
+            for endpoint in endpoints or self.ttls
+        ]
+        etag = hashlib.sha256(repr((spot_id, fetched)).encode()).hexdigest()[:32]
+        return etag, max(fetched) or None
+
+    def holds(self, spot_id: str, endpoints, values) -> bool:
+        """
+        Whether ``values`` are the spot's cached data for ``endpoints``, in
+        which case ``validator()`` describes them.
+        """
+        return all(
+            (entry := self.entry(endpoint, spot_id)) is not None
+            and entry.value is value
+            for endpoint, value in zip(endpoints, values, strict=True)
+        )
+
+    async def get(self, endpoint: str, spot_id: str):
+        key = self.key(endpoint, spot_id)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry.stale_until:
+            self._entries.move_to_end(key)
+            if now < entry.expires_at:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                self.refresh(endpoint, spot_id)
+            return entry.value
+        self.misses += 1
+        return await asyncio.shield(self.refresh(endpoint, spot_id))
+
+    def refresh(self, endpoint: str, spot_id: str) -> asyncio.Task:
+        """Start (or join) the upstream fetch for a key."""
+        key = self.key(endpoint, spot_id)
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._fetch(key, endpoint, spot_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    async def _fetch(self, key: tuple, endpoint: str, spot_id: str):
+        value = await self.fetch(endpoint, spot_id)
+        ttl = self.ttls[endpoint]
+        now = time.monotonic()
+        self._entries[key] = CacheEntry(
+            value=value,
+            fetched_at=time.time(),
+            expires_at=now + ttl,
+            stale_until=now + ttl * (1 + self.stale_factor),
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Forecast refresh for %s failed: %r", key, task.exception())
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+class FragmentCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, spot_id: str, version: str):
+        """The fragment rendered for ``version`` of the spot's forecast, if any."""
+        entry = self._entries.get(spot_id)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(spot_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, spot_id: str, version: str, fragment):
+        # Replaces the fragment rendered for an older version
+        self._entries[spot_id] = (version, fragment)
+        self._entries.move_to_end(spot_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,217 @@
+"""
+Parsers turning decoded Surfline forecast responses into template data.
+
+Each response is decoded once and walked in a single pass. Local times are
+plain ``timestamp + utcOffset * 3600`` arithmetic, so a ``datetime`` is only
+built for the rows that are kept, and wind rows are colored from a lookup
+table. Wind and wave rows are ``__slots__`` objects with the attribute names
+``surfline.html`` reads; a ``DayBreak`` starts each forecast day.
+"""
+
+import json
+from datetime import UTC, date, datetime, timedelta
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+DAY_MINUTES = 24 * 60
+KTS_TO_KPH = 1.852
+# Tides are kept for 3 full days plus an hour on either side
+TIDE_MINUTES_RANGE = (-60, 3 * DAY_MINUTES + 60)
+
+RED = "#E44D3A"
+GREEN = "#55AB68"
+ORANGE = "#D8833B"
+
+# Wind colors by direction type as (kph below, color), checked in order
+WIND_COLORS = {
+    "Onshore": ((10, GREEN), (30, ORANGE), (float("inf"), RED)),
+    "Cross-shore": ((20, GREEN), (40, ORANGE), (float("inf"), RED)),
+    "Offshore": ((30, GREEN), (float("inf"), ORANGE)),
+}
+DEFAULT_WIND_COLOR = "black"
+
+SUNLIGHT_EVENTS = (
+    ("dawn", "🔅 First Light"),
+    ("sunrise", "☀️ Sunrise"),
+    ("sunset", "☀️ Sunset"),
+    ("dusk", "🔅 Last Light"),
+)
+
+
+def loads(content: bytes):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def local_seconds(timestamp, utc_offset) -> float:
+    return timestamp + utc_offset * 3600
+
+
+def local_datetime(seconds: float) -> datetime:
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def midnight_seconds(today: date) -> int:
+    """``today``'s midnight in the same local-seconds scale."""
+    return (today - EPOCH.date()).days * 86400
+
+
+def wind_color(direction_type: str, speed: float) -> str:
+    for limit, color in WIND_COLORS.get(direction_type, ()):
+        if speed < limit:
+            return color
+    return DEFAULT_WIND_COLOR
+
+
+class DayBreak:
+    __slots__ = ("date",)
+
+    def __init__(self, date: datetime):
+        self.date = date
+
+
+class WindRow:
+    __slots__ = (
+        "color",
+        "date",
+        "direction",
+        "direction_type",
+        "gust",
+        "score",
+        "speed",
+    )
+
+    def __init__(self, date, direction, direction_type, speed, gust, score):
+        self.date = date
+        self.direction = direction
+        self.direction_type = direction_type
+        self.speed = speed
+        self.gust = gust
+        self.score = score
+        self.color = wind_color(direction_type, speed)
+
+
+class WaveRow:
+    __slots__ = (
+        "date",
+        "human",
+        "max",
+        "min",
+        "power",
+        "primary_swell_direction",
+        "primary_swell_period",
+        "primary_swell_size",
+        "score",
+    )
+
+    def __init__(self, date, surf, swell, power):
+        self.date = date
+        self.min = surf["min"]
+        self.max = surf["max"]
+        self.human = surf["humanRelation"]
+        self.score = surf["optimalScore"]
+        self.primary_swell_size = swell["height"]
+        self.primary_swell_period = swell["period"]
+        self.primary_swell_direction = swell["direction"]
+        self.power = power
+
+
+def forecast_rows(data, make_row) -> list:
+    """
+    Keep the 3-hourly rows from 6:00 on, with a ``DayBreak`` before each day.
+
+    ``make_row(date, item)`` builds the row for each kept item.
+    """
+    rows = []
+    prev_hour = 24
+    for item in data:
+        seconds = local_seconds(item["timestamp"], item["utcOffset"])
+        hour = int(seconds // 3600 % 24)
+        if hour % 3 != 0 or hour < 4:
+            continue
+        date = local_datetime(seconds)
+        if hour < prev_hour:
+            rows.append(DayBreak(date))
+        prev_hour = hour
+        rows.append(make_row(date, item))
+    return rows
+
+
+def parse_wind(payload) -> list:
+    def make_row(date, item):
+        return WindRow(
+            date,
+            item["direction"],
+            item["directionType"],
+            item["speed"] * KTS_TO_KPH,
+            item["gust"] * KTS_TO_KPH,
+            item["optimalScore"],
+        )
+
+    return forecast_rows(payload["data"]["wind"], make_row)
+
+
+def parse_waves(payload) -> list:
+    def make_row(date, item):
+        swell = max(item["swells"], key=lambda swell: swell["impact"])
+        return WaveRow(date, item["surf"], swell, item["power"])
+
+    return forecast_rows(payload["data"]["wave"], make_row)
+
+
+def parse_tides(payload, today: date) -> dict:
+    unit = payload["associated"]["units"]["tideHeight"].lower()
+    midnight = midnight_seconds(today)
+    low, high = TIDE_MINUTES_RANGE
+    chart_points = []
+    extremes = []
+    for tide in payload["data"]["tides"]:
+        seconds = local_seconds(tide["timestamp"], tide["utcOffset"])
+        minutes = int((seconds - midnight) // 60)
+        if minutes < low or minutes > high:
+            continue
+        height = tide["height"]
+        type = tide["type"]
+        chart_points.append({"minutes": minutes, "height": height, "type": type})
+        if type != "NORMAL":
+            extremes.append(
+                {
+                    "minutes": minutes,
+                    "height": height,
+                    "type": type,
+                    "time": local_datetime(seconds).strftime("%H:%M"),
+                    "label": f"{height:.2f}{unit}",
+                }
+            )
+    return {"chart_points": chart_points, "extremes": extremes, "unit": unit}
+
+
+def parse_sunlight(payload, today: date) -> dict:
+    midnight = midnight_seconds(today)
+    chart_data = []
+    display_days = []
+    for sun in payload["data"]["sunlight"]:
+        times = {
+            event: local_seconds(sun[event], sun[f"{event}UTCOffset"])
+            for event, _ in SUNLIGHT_EVENTS
+        }
+        # Every event is placed on the day of dawn
+        day_offset = int((times["dawn"] - midnight) // 86400) * DAY_MINUTES
+        chart_data.append(
+            {
+                event: day_offset + int(seconds % 86400 // 60)
+                for event, seconds in times.items()
+            }
+        )
+        display_days.append(
+            [
+                {"date": local_datetime(times[event]), "type": label}
+                for event, label in SUNLIGHT_EVENTS
+            ]
+        )
+    return {"display_days": display_days, "chart_data": chart_data}
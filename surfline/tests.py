@@ -0,0 +1,258 @@
+import asyncio
+from datetime import date
+from unittest import mock
+
+import httpx
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from cams import catalog
+from cams.models import Cam
+from surfline import urls
+from surfline.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from surfline.cache import CacheEntry, ForecastCache
+from surfline.parsers import GREEN, ORANGE, RED, DayBreak, parse_tides, parse_wind
+from surfline.urls import day_window, forecast_dates
+
+
+class TestForecastCache(SimpleTestCase):
+    def make_cache(self, **kwargs):
+        calls = []
+
+        async def fetch(endpoint, spot_id):
+            calls.append((endpoint, spot_id))
+            await asyncio.sleep(0)
+            return f"{endpoint}:{spot_id}"
+
+        return ForecastCache(fetch, **kwargs), calls
+
+    async def test_concurrent_misses_share_one_fetch(self):
+        cache, calls = self.make_cache()
+        results = await asyncio.gather(*(cache.get("wind", "spot") for _ in range(5)))
+        self.assertEqual(results, ["wind:spot"] * 5)
+        self.assertEqual(calls, [("wind", "spot")])
+        self.assertEqual(await cache.get("wind", "spot"), "wind:spot")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertGreater(cache.expires_in("wind", "spot"), 0)
+        self.assertEqual(cache.expires_in("waves", "spot"), float("-inf"))
+
+    async def test_stale_entry_is_served_while_refreshing(self):
+        cache, calls = self.make_cache(ttls={"wind": 0})
+        await cache.get("wind", "spot")
+        cache.entry("wind", "spot").stale_until += 60
+        self.assertEqual(await cache.get("wind", "spot"), "wind:spot")
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+        await cache.refresh("wind", "spot")
+        self.assertEqual(len(calls), 2)
+
+    async def test_lru_eviction(self):
+        cache, _ = self.make_cache(max_entries=2)
+        for spot in ("a", "b", "a", "c"):
+            await cache.get("wind", spot)
+        self.assertIsNotNone(cache.entry("wind", "a"))
+        self.assertIsNone(cache.entry("wind", "b"))
+        self.assertIsNotNone(cache.entry("wind", "c"))
+
+    async def test_validator_changes_when_refreshed(self):
+        cache, _ = self.make_cache(ttls={"wind": 60, "waves": 60})
+        empty = cache.validator("spot")
+        self.assertIsNone(empty[1])
+        await cache.get("wind", "spot")
+        await cache.get("waves", "spot")
+        fetched = cache.validator("spot")
+        self.assertNotEqual(fetched, empty)
+        self.assertEqual(cache.validator("spot"), fetched)
+        await cache.refresh("wind", "spot")
+        self.assertNotEqual(cache.validator("spot")[0], fetched[0])
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    def fail(self, breaker):
+        with self.assertRaises(httpx.ConnectError), breaker.guard():
+            raise httpx.ConnectError("down")
+
+    def test_opens_and_probes_half_open(self):
+        breaker = CircuitBreaker("wind", failure_threshold=2, reset_timeout=60)
+        self.fail(breaker)
+        self.assertEqual(breaker.state, CLOSED)
+        self.fail(breaker)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen), breaker.guard():
+            pass
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # A failed probe opens it again right away
+        self.fail(breaker)
+        self.assertEqual(breaker.state, OPEN)
+        breaker.opened_at -= 60
+        # Only one probe at a time
+        with breaker.guard(), self.assertRaises(CircuitOpen), breaker.guard():
+            pass
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()["rejected"], 2)
+
+    def test_slow_closed_call_does_not_end_probe(self):
+        breaker = CircuitBreaker("wind", failure_threshold=1, reset_timeout=60)
+        probe = breaker.guard()
+        # Let through while closed, but only fails once a probe is in flight
+        with self.assertRaises(httpx.ConnectError), breaker.guard():
+            self.fail(breaker)
+            breaker.opened_at -= 60
+            probe.__enter__()
+            raise httpx.ConnectError("down")
+        breaker.opened_at -= 60
+        with self.assertRaises(CircuitOpen), breaker.guard():
+            pass
+        probe.__exit__(None, None, None)
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class TestFetchForecast(SimpleTestCase):
+    @override_settings(SURFLINE_DEADLINE_SECONDS=0.05)
+    async def test_failed_and_slow_endpoints_fall_back(self):
+        async def fetch(endpoint, spot_id):
+            if endpoint == "tides" and spot_id == "spot":
+                return "tides"
+            if endpoint == "sunlight":
+                await asyncio.sleep(1)
+            raise httpx.ConnectError("down")
+
+        cache = ForecastCache(fetch)
+        # Expired long ago, but still the last wind data for the spot
+        cache._entries[cache.key("wind", "spot")] = CacheEntry("old wind", 0, 0, 0)
+        with mock.patch("surfline.urls.forecast_cache", cache):
+            forecast = await urls.fetch_forecast("spot")
+            self.assertEqual(forecast, ("tides", None, "old wind", []))
+            with self.assertRaises(urls.ForecastUnavailable):
+                await urls.fetch_forecast("down")
+        # Don't leave the slow sunlight fetches running after the test
+        pending = list(cache._inflight.values())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class TestParsers(SimpleTestCase):
+    def wind(self, hour, direction_type="Onshore", speed=3.0):
+        return {
+            "timestamp": 86400 + hour * 3600,
+            "utcOffset": -1,
+            "direction": 90,
+            "directionType": direction_type,
+            "speed": speed,
+            "gust": speed,
+            "optimalScore": 0,
+        }
+
+    def test_wind_rows(self):
+        hours = [1, 4, 5, 7, 22, 28, 31]  # local 0:00, 3:00, 4:00, 6:00, ...
+        payload = {"data": {"wind": [self.wind(hour) for hour in hours]}}
+        rows = parse_wind(payload)
+        self.assertEqual(
+            [(type(row).__name__, row.date.hour) for row in rows],
+            [
+                ("DayBreak", 6),
+                ("WindRow", 6),
+                ("WindRow", 21),
+                ("DayBreak", 6),
+                ("WindRow", 6),
+            ],
+        )
+        self.assertIsInstance(rows[0], DayBreak)
+        self.assertAlmostEqual(rows[1].speed, 3 * 1.852)
+
+    def test_wind_colors(self):
+        cases = [
+            ("Onshore", 5, GREEN),
+            ("Onshore", 10, ORANGE),
+            ("Onshore", 20, RED),
+            ("Cross-shore", 20, ORANGE),
+            ("Offshore", 20, ORANGE),
+            ("Glassy", 20, "black"),
+        ]
+        for direction_type, knots, color in cases:
+            payload = {"data": {"wind": [self.wind(7, direction_type, knots)]}}
+            self.assertEqual(parse_wind(payload)[1].color, color, direction_type)
+
+    def test_tides_are_relative_to_today(self):
+        payload = {
+            "associated": {"units": {"tideHeight": "M"}},
+            "data": {
+                "tides": [
+                    {"timestamp": ts, "utcOffset": 2, "height": 1.5, "type": type}
+                    for ts, type in ((86400, "HIGH"), (86400 + 3600, "NORMAL"))
+                ]
+            },
+        }
+        tides = parse_tides(payload, date(1970, 1, 2))
+        self.assertEqual([p["minutes"] for p in tides["chart_points"]], [120, 180])
+        self.assertEqual(tides["extremes"][0]["time"], "02:00")
+        self.assertEqual(tides["extremes"][0]["label"], "1.50m")
+
+    def test_forecast_dates_are_local_to_the_spot(self):
+        # US West Coast: local 6:00 on Jan 1 and 2, while it's Jan 2 in UTC
+        wind = [
+            {**self.wind(0), "timestamp": (hour + 7) * 3600, "utcOffset": -7}
+            for hour in (6, 30)
+        ]
+        rows = parse_wind({"data": {"wind": wind}})
+        self.assertEqual(
+            forecast_dates(rows, date(1970, 1, 2)),
+            [date(1970, 1, 1), date(1970, 1, 2), date(1970, 1, 3)],
+        )
+        self.assertEqual(
+            forecast_dates([], date(1970, 1, 2)),
+            [date(1970, 1, 2), date(1970, 1, 3), date(1970, 1, 4)],
+        )
+
+    def test_day_window(self):
+        points = [{"minutes": m, "height": 1.0} for m in (-60, 0, 1439, 1500, 1501)]
+        index = [p["minutes"] for p in points]
+        self.assertEqual(
+            [p["minutes"] for p in day_window(points, index, 0)], [-60, 0, 1439, 1500]
+        )
+        self.assertEqual(
+            [p["minutes"] for p in day_window(points, index, 1440)], [-1, 60, 61]
+        )
+
+
+class TestSurflineFragment(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+        urls.fragment_cache.clear()
+        urls.forecast_cache.clear()
+        self.addCleanup(urls.forecast_cache.clear)
+
+    def test_sections_are_shared_by_cams_on_a_spot(self):
+        cams = [
+            Cam.objects.create(slug=f"cam-{i}", url="https://cam.test/", spot_id="spot")
+            for i in range(2)
+        ]
+        skeleton = self.client.get(f"/surfline/{cams[0].id}/")
+        self.assertContains(skeleton, 'id="forecast-tides-2"')
+        self.assertContains(skeleton, f'hx-get="/surfline/{cams[0].id}/conditions/"')
+
+        fetch = mock.AsyncMock(return_value=[])
+        render = mock.Mock(wraps=urls.render_conditions)
+        with (
+            mock.patch.object(urls.forecast_cache, "fetch", fetch),
+            mock.patch.dict(urls.SECTIONS, conditions=(("wind", "waves"), render)),
+        ):
+            first = self.client.get(f"/surfline/{cams[0].id}/conditions/")
+            second = self.client.get(
+                f"/surfline/{cams[1].id}/conditions/",
+                headers={"Accept-Encoding": "gzip"},
+            )
+            not_modified = self.client.get(
+                f"/surfline/{cams[1].id}/conditions/",
+                headers={"If-None-Match": first["ETag"]},
+            )
+        self.assertContains(first, 'id="forecast-conditions-2" hx-swap-oob="true"')
+        # The conditions fill in the day headings, empty in the skeleton
+        self.assertContains(skeleton, '<h4 id="forecast-date-0"></h4>', html=True)
+        self.assertContains(first, 'id="forecast-date-2" hx-swap-oob="true"')
+        # The cold fetch filled the forecast cache and its render was kept
+        self.assertEqual(fetch.await_count, 2)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(second["Content-Encoding"], "gzip")
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.client.get(f"/surfline/{cams[0].id}/x/").status_code, 404)
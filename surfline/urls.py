@@ -1,285 +1,314 @@
 import asyncio
 import json
-from datetime import UTC, datetime
+import time
+from bisect import bisect_left, bisect_right
+from datetime import UTC, date, datetime, timedelta
 
 import httpx
 import stamina
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from stamina.instrumentation import RetryDetails, get_on_retry_hooks, set_on_retry_hooks
 
-from cams.models import Cam
+from cams.index import aget_index
+from surfcamsapi.compression import CompressedPayload
+from surfcamsapi.http import get_client
+from surfcamsapi.metrics import (
+    surfline_fallbacks,
+    surfline_request_seconds,
+    surfline_retries,
+)
+
+from .breaker import CircuitBreaker
+from .cache import ForecastCache, FragmentCache
+from .parsers import (
+    DAY_MINUTES,
+    DayBreak,
+    loads,
+    parse_sunlight,
+    parse_tides,
+    parse_waves,
+    parse_wind,
+)
+
+CHART_MARGIN_MINUTES = 60
+FORECAST_DAYS = 3
+FORECAST_ENDPOINTS = ("tides", "sunlight", "wind", "waves")
+# Surfline URL paths of the endpoints whose names differ
+ENDPOINT_PATHS = {"waves": "wave"}
+# What the forecast endpoints render as when there is no data
+EMPTY_FORECAST = (None, None, [], [])
+EMPTY_DATA = dict(zip(FORECAST_ENDPOINTS, EMPTY_FORECAST))
+
+
+class ForecastUnavailable(Exception):
+    """No forecast data could be fetched or found in the cache for a spot."""
 
 
 async def get_surfline_data(request, cam_id: int):
-    try:
-        cam = await Cam.objects.aget(id=cam_id)
-    except Cam.DoesNotExist:
+    """
+    The forecast skeleton, one block per day.
+
+    The sections are loaded with separate requests and each fills in its part
+    of every day as soon as its own endpoints answer, so tides and sunlight
+    (cached for a day) don't wait for wind and waves.
+    """
+    index = await aget_index()
+    if (cam := index.cams_by_id.get(cam_id)) is None:
         return render(request, "surfline-error.html", {"message": "Cam not found"})
-    async with httpx.AsyncClient() as client:
-        fetcher = SurflineFetcher(cam.spot_id, client)
-        try:
-            tides, sunlight, wind, waves = await fetcher.fetch_all()
-        except httpx.HTTPError:
-            return render(request, "surfline-error.html", {"cam": cam})
-    # Group wind/wave data by day
-    forecast_days = []
-    current_day = None
-    for w, wv in zip(wind, waves):
-        if w.get("break"):
-            current_day = {"date": w["date"], "rows": [], "sunlight": []}
-            forecast_days.append(current_day)
-        elif current_day is not None:
-            current_day["rows"].append({"wind": w, "wave": wv})
-
-    # Attach per-day sunlight display
-    if sunlight:
-        for i, day in enumerate(forecast_days):
-            if i < len(sunlight["display_days"]):
-                day["sunlight"] = sunlight["display_days"][i]
+    return render(request, "surfline.html", forecast_context(cam))
+
+
+def forecast_context(cam) -> dict:
+    """Context of the ``surfline.html`` skeleton for ``cam``."""
+    if not cam.spot_id:
+        return {"cam": cam, "days": []}
+    # The days' dates are local to the spot, so the conditions section fills
+    # them in from its rows
+    return {"cam": cam, "days": range(FORECAST_DAYS), "sections": SECTIONS}
+
 
+async def get_surfline_section(request, cam_id: int, section: str):
+    if section not in SECTIONS:
+        raise Http404("Unknown forecast section")
+    endpoints, render_section = SECTIONS[section]
+    index = await aget_index()
+    if (cam := index.cams_by_id.get(cam_id)) is None:
+        return render(request, "surfline-error.html", {"message": "Cam not found"})
+    try:
+        data = await fetch_forecast(cam.spot_id, endpoints)
+    except ForecastUnavailable:
+        return render(request, "surfline-error.html", {"cam": cam, "section": section})
+    etag, last_modified = forecast_cache.validator(cam.spot_id, endpoints)
+    # Tide and sunlight minutes are relative to today
+    version = f"{etag}-{datetime.now(UTC).date():%Y%m%d}"
+    key = f"{section}:{cam.spot_id}"
+    if (payload := fragment_cache.get(key, version)) is None:
+        payload = CompressedPayload(
+            render_section(*data).encode(),
+            "text/html; charset=utf-8",
+            last_modified,
+            etag=version,
+        )
+        # Only keep it if the validator is the data's, and not the one of a
+        # refresh that finished while we were fetching
+        if forecast_cache.holds(cam.spot_id, endpoints, data):
+            fragment_cache.set(key, version, payload)
+    return payload.response(request, cache_control="private, no-cache")
+
+
+def render_tides(tides, sunlight) -> str:
     # Build per-day chart data (normalize minutes to 0-1440)
+    points = tides["chart_points"] if tides else []
+    extremes = tides["extremes"] if tides else []
+    point_index = [p["minutes"] for p in points]
+    extreme_index = [e["minutes"] for e in extremes]
+    days = []
     chart_days = []
-    for d in range(len(forecast_days)):
-        day_offset = d * 1440
-        if tides:
-            day_points = [
-                {
-                    "minutes": p["minutes"] - day_offset,
-                    "height": p["height"],
-                    "type": p["type"],
-                }
-                for p in tides["chart_points"]
-                if day_offset - 60 <= p["minutes"] <= day_offset + 1500
-            ]
-            day_extremes = [
-                {**e, "minutes": e["minutes"] - day_offset}
-                for e in tides["extremes"]
-                if day_offset - 60 <= e["minutes"] <= day_offset + 1500
-            ]
-        else:
-            day_points = []
-            day_extremes = []
-
+    for d in range(FORECAST_DAYS):
+        day_offset = d * DAY_MINUTES
         day_sun = None
+        display = []
         if sunlight and d < len(sunlight["chart_data"]):
             raw = sunlight["chart_data"][d]
             day_sun = {k: v - day_offset for k, v in raw.items()}
-
+            display = sunlight["display_days"][d]
+        days.append({"sunlight": display})
         chart_days.append(
             {
-                "chart_points": day_points,
-                "extremes": day_extremes,
+                "chart_points": day_window(points, point_index, day_offset),
+                "extremes": day_window(extremes, extreme_index, day_offset),
                 "sunlight": day_sun,
             }
         )
 
-    return render(
-        request,
-        "surfline.html",
+    return render_to_string(
+        "surfline-tides.html",
         {
-            "forecast_days": forecast_days,
+            "days": days,
             "chart_days_json": json.dumps(chart_days),
             "tide_unit": tides["unit"] if tides else "",
         },
     )
 
 
+def render_conditions(wind, waves) -> str:
+    # Group wind/wave data by day
+    rows = []
+    for w, wv in zip(wind, waves):
+        if isinstance(w, DayBreak):
+            rows.append([])
+        elif rows:
+            rows[-1].append({"wind": w, "wave": wv})
+    # Every day's block is swapped, also the ones without data
+    days = [
+        {"date": day, "rows": rows[i] if i < len(rows) else []}
+        for i, day in enumerate(forecast_dates(wind, datetime.now(UTC).date()))
+    ]
+    return render_to_string("surfline-conditions.html", {"days": days})
+
+
+# Forecast sections by name: their endpoints and renderer
+SECTIONS = {
+    "tides": (("tides", "sunlight"), render_tides),
+    "conditions": (("wind", "waves"), render_conditions),
+}
+
+
+def forecast_dates(wind, today: date) -> list[date]:
+    """
+    The dates of the forecast days, local to the spot.
+
+    They are the dates of the day breaks in ``wind``, then the days after
+    them, or the days from ``today`` when there are no rows.
+    """
+    dates = [row.date.date() for row in wind if isinstance(row, DayBreak)]
+    dates = dates[:FORECAST_DAYS] or [today]
+    while len(dates) < FORECAST_DAYS:
+        dates.append(dates[-1] + timedelta(days=1))
+    return dates
+
+
+def day_window(items: list[dict], index: list[int], day_offset: int) -> list[dict]:
+    """
+    Items charted on the day starting at ``day_offset``, shifted to that day.
+
+    ``index`` holds the ascending ``minutes`` of ``items``, so each day is a
+    slice found by bisection. Days overlap by CHART_MARGIN_MINUTES.
+    """
+    start = bisect_left(index, day_offset - CHART_MARGIN_MINUTES)
+    end = bisect_right(index, day_offset + DAY_MINUTES + CHART_MARGIN_MINUTES)
+    return [
+        {**item, "minutes": item["minutes"] - day_offset} for item in items[start:end]
+    ]
+
+
 class SurflineFetcher:
     def __init__(self, spot_id: str, client):
-        self.base_url = "https://services.surfline.com/kbyg/spots/forecasts/"
+        self.base_url = settings.SURFLINE_BASE_URL
         self.client = client
         self.day_params = {"spotId": spot_id, "days": 3}
         self.spot_id = spot_id
 
+    async def get(self, endpoint: str, params: dict):
+        with breakers[endpoint].guard():
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                response = await self.client.get(
+                    self.base_url + ENDPOINT_PATHS.get(endpoint, endpoint),
+                    timeout=5.0,
+                    params=params,
+                )
+                outcome = str(response.status_code)
+            finally:
+                surfline_request_seconds.observe(
+                    time.perf_counter() - start, endpoint, outcome
+                )
+            if response.status_code != 200:
+                raise httpx.HTTPError("Non-200 response")
+            return loads(response.content)
+
     @stamina.retry(on=httpx.HTTPError, attempts=3)
     async def fetch_tides(self):
-        tide_response = await self.client.get(
-            self.base_url + "tides",
-            timeout=5.0,
-            params={"spotId": self.spot_id, "days": 4},
-        )
-        if tide_response.status_code != 200:
-            raise httpx.HTTPError("Non-200 response")
-        unit = tide_response.json()["associated"]["units"]["tideHeight"].lower()
-        today = datetime.now(UTC).date()
-        chart_points = []
-        extremes = []
-        for tide in tide_response.json()["data"]["tides"]:
-            date = datetime.fromtimestamp(
-                tide["timestamp"] + tide["utcOffset"] * 3600, tz=UTC
-            )
-            # Minutes relative to today's midnight
-            day_diff = (date.date() - today).days
-            minutes = day_diff * 1440 + date.hour * 60 + date.minute
-            # Include 3 full days with buffer
-            if minutes < -60 or minutes > 4380:
-                continue
-            chart_points.append(
-                {
-                    "minutes": minutes,
-                    "height": tide["height"],
-                    "type": tide["type"],
-                }
-            )
-            if tide["type"] != "NORMAL":
-                extremes.append(
-                    {
-                        "minutes": minutes,
-                        "height": tide["height"],
-                        "type": tide["type"],
-                        "time": date.strftime("%H:%M"),
-                        "label": f"{tide['height']:.2f}{unit}",
-                    }
-                )
-        return {
-            "chart_points": chart_points,
-            "extremes": extremes,
-            "unit": unit,
-        }
+        payload = await self.get("tides", {"spotId": self.spot_id, "days": 4})
+        return parse_tides(payload, datetime.now(UTC).date())
 
     @stamina.retry(on=httpx.HTTPError, attempts=3)
     async def fetch_sunlight(self):
-        sunlight_response = await self.client.get(
-            self.base_url + "sunlight",
-            timeout=5.0,
-            params=self.day_params,
-        )
-        if sunlight_response.status_code != 200:
-            raise httpx.HTTPError("Non-200 response")
-
-        today = datetime.now(UTC).date()
-        chart_data = []
-        display_days = []
-
-        for sun in sunlight_response.json()["data"]["sunlight"]:
-            def to_date(ts, offset):
-                return datetime.fromtimestamp(ts + offset * 3600, tz=UTC)
-
-            dawn_date = to_date(sun["dawn"], sun["dawnUTCOffset"])
-            day_diff = (dawn_date.date() - today).days
-            day_offset = day_diff * 1440
-
-            def to_minutes(ts, offset):
-                d = datetime.fromtimestamp(ts + offset * 3600, tz=UTC)
-                return day_offset + d.hour * 60 + d.minute
-
-            chart_data.append({
-                "dawn": to_minutes(sun["dawn"], sun["dawnUTCOffset"]),
-                "sunrise": to_minutes(sun["sunrise"], sun["sunriseUTCOffset"]),
-                "sunset": to_minutes(sun["sunset"], sun["sunsetUTCOffset"]),
-                "dusk": to_minutes(sun["dusk"], sun["duskUTCOffset"]),
-            })
-
-            display_days.append([
-                {"date": to_date(sun["dawn"], sun["dawnUTCOffset"]), "type": "🔅 First Light"},
-                {"date": to_date(sun["sunrise"], sun["sunriseUTCOffset"]), "type": "☀️ Sunrise"},
-                {"date": to_date(sun["sunset"], sun["sunsetUTCOffset"]), "type": "☀️ Sunset"},
-                {"date": to_date(sun["dusk"], sun["duskUTCOffset"]), "type": "🔅 Last Light"},
-            ])
-
-        return {
-            "display_days": display_days,
-            "chart_data": chart_data,
-        }
+        payload = await self.get("sunlight", self.day_params)
+        return parse_sunlight(payload, datetime.now(UTC).date())
 
     @stamina.retry(on=httpx.HTTPError, attempts=3)
     async def fetch_wind(self):
-        wind_response = await self.client.get(
-            self.base_url + "wind",
-            timeout=5.0,
-            params=self.day_params,
-        )
-        if wind_response.status_code != 200:
-            raise httpx.HTTPError("Non-200 response")
-        res = []
-        data = wind_response.json()["data"]["wind"]
-        prev_hour = 24
-        for d in data:
-            date = datetime.fromtimestamp(d["timestamp"] + d["utcOffset"] * 3600, tz=UTC)
-            if date.hour % 3 != 0 or date.hour < 4:
-                continue
-            if date.hour < prev_hour:
-                res.append({"date": date, "break": True})
-            prev_hour = date.hour
-            direction_type = d["directionType"]
-            speed = d["speed"] * 1.852  # kts to kph
-            color = "black"
-
-            class Colors:
-                red = "#E44D3A"
-                green = "#55AB68"
-                orange = "#D8833B"
-
-            match direction_type:
-                case "Onshore" if speed < 10:
-                    color = Colors.green
-                case "Onshore" if speed < 30:
-                    color = Colors.orange
-                case "Onshore":
-                    color = Colors.red
-                case "Cross-shore" if speed < 20:
-                    color = Colors.green
-                case "Cross-shore" if speed < 40:
-                    color = Colors.orange
-                case "Cross-shore":
-                    color = Colors.red
-                case "Offshore" if speed < 30:
-                    color = Colors.green
-                case "Offshore":
-                    color = Colors.orange
-            res.append(
-                {
-                    "date": date,
-                    "direction": d["direction"],
-                    "direction_type": d["directionType"],
-                    "speed": d["speed"] * 1.852,  # kts to kph
-                    "gust": d["gust"] * 1.852,  # kts to kph
-                    "score": d["optimalScore"],
-                    "color": color,
-                }
-            )
-        return res
+        return parse_wind(await self.get("wind", self.day_params))
 
     @stamina.retry(on=httpx.HTTPError, attempts=3)
     async def fetch_waves(self):
-        wave_response = await self.client.get(
-            self.base_url + "wave",
-            timeout=5.0,
-            params=self.day_params,
-        )
-        if wave_response.status_code != 200:
-            raise httpx.HTTPError("Non-200 response")
-        res = []
-        data = wave_response.json()["data"]["wave"]
-        prev_hour = 24
-        for d in data:
-            date = datetime.fromtimestamp(d["timestamp"] + d["utcOffset"] * 3600, tz=UTC)
-            if date.hour % 3 != 0 or date.hour < 4:
-                continue
-            if date.hour < prev_hour:
-                res.append({"date": date, "break": True})
-            prev_hour = date.hour
-            swells = sorted(d["swells"], key=lambda x: x["impact"], reverse=True)
-            res.append(
-                {
-                    "date": date,
-                    "min": d["surf"]["min"],
-                    "max": d["surf"]["max"],
-                    "human": d["surf"]["humanRelation"],
-                    "score": d["surf"]["optimalScore"],
-                    "primary_swell_size": swells[0]["height"],
-                    "primary_swell_period": swells[0]["period"],
-                    "primary_swell_direction": swells[0]["direction"],
-                    "power": d["power"],
-                }
-            )
-        return res
+        return parse_waves(await self.get("waves", self.day_params))
 
     async def fetch_all(self):
+        """All four endpoints, with no data for the ones that failed."""
         if not self.spot_id:
-            return None, None, [], []
-        return await asyncio.gather(
+            return EMPTY_FORECAST
+        results = await asyncio.gather(
             self.fetch_tides(),
             self.fetch_sunlight(),
             self.fetch_wind(),
             self.fetch_waves(),
+            return_exceptions=True,
+        )
+        if all(isinstance(result, Exception) for result in results):
+            raise ForecastUnavailable(self.spot_id) from results[0]
+        return tuple(
+            empty if isinstance(result, Exception) else result
+            for result, empty in zip(results, EMPTY_FORECAST)
         )
+
+
+def count_retry(details: RetryDetails):
+    # details.name is the qualified name of the retried SurflineFetcher.fetch_* method
+    _, _, endpoint = details.name.rpartition(".fetch_")
+    if endpoint:
+        surfline_retries.inc(endpoint)
+
+
+set_on_retry_hooks([*get_on_retry_hooks(), count_retry])
+
+
+async def fetch_endpoint(endpoint: str, spot_id: str):
+    fetcher = SurflineFetcher(spot_id, get_client())
+    return await getattr(fetcher, f"fetch_{endpoint}")()
+
+
+breakers = {
+    endpoint: CircuitBreaker(
+        endpoint,
+        failure_threshold=settings.SURFLINE_BREAKER_FAILURES,
+        reset_timeout=settings.SURFLINE_BREAKER_RESET_SECONDS,
+    )
+    for endpoint in FORECAST_ENDPOINTS
+}
+forecast_cache = ForecastCache(
+    fetch_endpoint, max_entries=settings.FORECAST_CACHE_MAX_ENTRIES
+)
+fragment_cache = FragmentCache()
+
+
+async def fetch_forecast(spot_id: str, endpoints=FORECAST_ENDPOINTS):
+    """
+    Cached equivalent of ``SurflineFetcher.fetch_all``, for ``endpoints``.
+
+    The endpoints share a ``SURFLINE_DEADLINE_SECONDS`` budget. The ones that
+    fail or miss it fall back to the last data cached for the spot, while
+    their fetches carry on in the background for the following requests.
+    """
+    if not spot_id:
+        return tuple(EMPTY_DATA[endpoint] for endpoint in endpoints)
+    tasks = [
+        asyncio.ensure_future(forecast_cache.get(endpoint, spot_id))
+        for endpoint in endpoints
+    ]
+    try:
+        await asyncio.wait(tasks, timeout=settings.SURFLINE_DEADLINE_SECONDS)
+    finally:
+        # Only stops waiting, forecast_cache.get() shields the fetch itself
+        for task in tasks:
+            task.cancel()
+    forecast = []
+    missing = 0
+    for endpoint, task in zip(endpoints, tasks):
+        if task.done() and task.exception() is None:
+            forecast.append(task.result())
+        elif (entry := forecast_cache.entry(endpoint, spot_id)) is not None:
+            surfline_fallbacks.inc(endpoint, "stale")
+            forecast.append(entry.value)
+        else:
+            surfline_fallbacks.inc(endpoint, "missing")
+            forecast.append(EMPTY_DATA[endpoint])
+            missing += 1
+    if missing == len(endpoints):
+        raise ForecastUnavailable(spot_id)
+    return tuple(forecast)